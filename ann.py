@@ -0,0 +1,193 @@
+import time
+import numpy as np
+from similarity import normalize, top_k
+
+# Inverted-file (IVF) approximate nearest-neighbour index, CPU only.
+# Every category gets its own set of k-means coarse lists, so a same-category
+# search only probes that partition's lists while an any-category search
+# probes the best lists across all partitions.
+
+FLAT_PARTITION_ROWS = 1000
+KMEANS_SAMPLE = 20000
+KMEANS_ITERATIONS = 10
+
+
+class _Bucket:
+    # Growable id/vector arrays for one inverted list; deletes are tombstones.
+    def __init__(self, dim):
+        self.ids = np.zeros(16, dtype=np.int64)
+        self.vectors = np.zeros((16, dim), dtype=np.float32)
+        self.alive = np.zeros(16, dtype=bool)
+        self.size = 0
+        self.dead = 0
+
+    def append(self, product_id, vector):
+        if self.size == len(self.ids):
+            grow = len(self.ids)
+            self.ids = np.concatenate([self.ids, np.zeros(grow, dtype=np.int64)])
+            self.vectors = np.concatenate([self.vectors, np.zeros((grow, self.vectors.shape[1]), dtype=np.float32)])
+            self.alive = np.concatenate([self.alive, np.zeros(grow, dtype=bool)])
+        slot = self.size
+        self.ids[slot] = product_id
+        self.vectors[slot] = vector
+        self.alive[slot] = True
+        self.size += 1
+        return slot
+
+    def extend(self, ids, vectors):
+        self.ids = np.concatenate([self.ids[:self.size], ids])
+        self.vectors = np.concatenate([self.vectors[:self.size], vectors])
+        self.alive = np.concatenate([self.alive[:self.size], np.ones(len(ids), dtype=bool)])
+        start, self.size = self.size, self.size + len(ids)
+        return range(start, self.size)
+
+    def compact(self):
+        keep = np.flatnonzero(self.alive[:self.size])
+        self.ids, self.vectors = self.ids[keep], self.vectors[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.size, self.dead = len(keep), 0
+
+
+def kmeans(vectors, nlist, seed=0):
+    # Spherical k-means on a sample; returns normalized centroids.
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > KMEANS_SAMPLE:
+        sample = vectors[rng.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        sums[empty] = centroids[empty]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign_lists(vectors, centroids, chunk=65536):
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        out[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+class PartitionedIVF:
+    def __init__(self, dim, nprobe=16):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.centroids = np.zeros((0, dim), dtype=np.float32)
+        self.buckets = []
+        self.partitions = {}
+        self.where = {}
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, product_id):
+        return int(product_id) in self.where
+
+    @classmethod
+    def build(cls, product_ids, vectors, categories, nprobe=16, seed=0):
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        categories = np.asarray(categories, dtype=object)
+        index = cls(vectors.shape[1], nprobe)
+        for category in dict.fromkeys(categories):
+            rows = np.flatnonzero(categories == category)
+            part_vectors = np.asarray(vectors[rows], dtype=np.float32)
+            nlist = 1 if len(rows) < FLAT_PARTITION_ROWS else int(4 * np.sqrt(len(rows)))
+            centroids = kmeans(part_vectors, nlist, seed) if nlist > 1 else normalize(part_vectors.mean(axis=0, keepdims=True))
+            first = index._add_lists(category, centroids)
+            assign = assign_lists(part_vectors, centroids)
+            for list_no in range(nlist):
+                members = np.flatnonzero(assign == list_no)
+                slots = index.buckets[first + list_no].extend(product_ids[rows[members]], part_vectors[members])
+                for pid, slot in zip(product_ids[rows[members]].tolist(), slots):
+                    index.where[pid] = (first + list_no, slot)
+        return index
+
+    def _add_lists(self, category, centroids):
+        first = len(self.buckets)
+        self.centroids = np.concatenate([self.centroids, centroids.astype(np.float32)])
+        self.buckets.extend(_Bucket(self.dim) for _ in range(len(centroids)))
+        self.partitions[category] = np.arange(first, first + len(centroids))
+        return first
+
+    def add(self, product_id, vector, category):
+        product_id = int(product_id)
+        if product_id in self.where:
+            self.remove(product_id)
+        vector = normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+        lists = self.partitions.get(category)
+        if lists is None:
+            list_no = self._add_lists(category, vector)
+        else:
+            list_no = int(lists[np.argmax(self.centroids[lists] @ vector[0])])
+        self.where[product_id] = (list_no, self.buckets[list_no].append(product_id, vector[0]))
+
+    def remove(self, product_id):
+        list_no, slot = self.where.pop(int(product_id))
+        bucket = self.buckets[list_no]
+        bucket.alive[slot] = False
+        bucket.dead += 1
+        if bucket.dead > bucket.size // 4 + 16:
+            bucket.compact()
+            for s, pid in enumerate(bucket.ids[:bucket.size].tolist()):
+                self.where[pid] = (list_no, s)
+
+    def search(self, query, k, category=None, nprobe=None):
+        # Returns (product_ids, scores) of the k best matches, best first.
+        query = normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        lists = self.partitions.get(category) if category is not None else np.arange(len(self.buckets))
+        if lists is None or not len(lists):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        probe = lists[top_k(self.centroids[lists] @ query, np.ones(len(lists), dtype=bool), nprobe or self.nprobe)]
+        ids, scores = [], []
+        for list_no in probe:
+            bucket = self.buckets[list_no]
+            alive = bucket.alive[:bucket.size]
+            ids.append(bucket.ids[:bucket.size][alive])
+            scores.append(bucket.vectors[:bucket.size][alive] @ query)
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        best = top_k(scores, np.ones(len(scores), dtype=bool), k)
+        return ids[best], scores[best]
+
+
+def recall_at_k(ann, exact, queries, k=10, nprobes=(1, 4, 16, 64, 128, 256, 512), categories=None, row_categories=None):
+    # Recall@k of the ANN index against exact scoring over the same vectors,
+    # with mean per-query latency, for each nprobe setting. With categories
+    # (one per query, plus row_categories aligned with exact.ids) both sides
+    # search only the query's category.
+    exact_top = []
+    for i, query in enumerate(queries):
+        scores = exact.score(query)
+        mask = np.ones(len(scores), dtype=bool)
+        if categories is not None:
+            mask = row_categories == categories[i]
+        exact_top.append(set(exact.ids[top_k(scores, mask, k)].tolist()))
+    results = []
+    for nprobe in nprobes:
+        hits, start = 0, time.perf_counter()
+        for i, query in enumerate(queries):
+            ids, _ = ann.search(query, k, None if categories is None else categories[i], nprobe)
+            hits += len(exact_top[i] & set(ids.tolist()))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "nprobe": nprobe,
+            "recall": hits / max(1, sum(len(t) for t in exact_top)),
+            "latency_ms": elapsed * 1000 / max(1, len(queries)),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    import backend
+    exact = backend.get_semantic_index()
+    ann = backend.build_ann_index()
+    row_categories = backend.index_categories(exact)
+    rows = np.random.default_rng(0).choice(len(exact), min(200, len(exact)), replace=False)
+    queries = np.asarray(exact.matrix[rows])
+    for label, cats in (("any category", None), ("same category", row_categories[rows])):
+        print(f"recall@10, {label} ({len(ann)} vectors, {len(ann.buckets)} lists)")
+        for r in recall_at_k(ann, exact, queries, 10, categories=cats, row_categories=row_categories):
+            print(f"  nprobe={r['nprobe']:<4} recall={r['recall']:.3f}  {r['latency_ms']:.2f} ms/query")
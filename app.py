@@ -1,11 +1,17 @@
+import boot
+import os
 import streamlit as st
 from backend import (
-    init_db, load_csv_to_db, train_semantic_embeddings,
+    init_db, bootstrap_catalog, warm_up, get_catalog, get_name_index, get_ann_index,
     login_user, register_user, get_recommendations
 )
 import matplotlib.pyplot as plt
-import pandas as pd
-import sqlite3
+import numpy as np
+from typeahead import TypeaheadIndex
+from db import get_meta
+import telemetry
+import popularity
+boot.mark("imports")
 
 st.set_page_config(page_title="Smart Substitution", layout="wide", page_icon="🛒")
 
@@ -21,8 +27,11 @@ for k, v in {
     if k not in st.session_state:
         st.session_state[k] = v
 
-DB_PATH = "products.db"
 CSV_PATH = "walmart.csv"
+# DEBUG_PANEL=1 turns on backend instrumentation and a sidebar stage breakdown.
+DEBUG_PANEL = os.environ.get("DEBUG_PANEL") == "1"
+if DEBUG_PANEL:
+    telemetry.enable()
 
 # --- Beautiful Blue Gradient Theme ---
 themes = {
@@ -78,21 +87,52 @@ apply_theme()
 # -- Backend DB Setup (runs once) --
 @st.cache_resource
 def setup_app():
-    init_db()
-    load_csv_to_db(CSV_PATH)
+    with boot.stage("init_db"):
+        init_db()
+    with boot.stage("catalog bootstrap"):
+        bootstrap_catalog(CSV_PATH)
+    # Typo-tolerant lookup is on every request's path, and on large catalogs
+    # so is the ANN index (tens of seconds to build); build both up front.
+    with boot.stage("name index"):
+        get_name_index()
+    with boot.stage("ann index"):
+        get_ann_index()
+    if os.environ.get("WARM_UP_MODEL") == "1":
+        warm_up()
+    print(boot.report())
 setup_app()
 
-def get_all_product_info():
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql("SELECT product_id, * FROM products", conn)
-    conn.close()
-    return df
+# Catalog views are shared across sessions and rebuilt only when product
+# names change (names_version moves; stock and price updates leave it).
+@st.cache_resource(max_entries=2)
+def product_search_index(names_version):
+    return TypeaheadIndex(get_catalog().columns['product_name'])
 
-def trending_products(df, n=5):
-    return df.sample(n=min(n, len(df)))
+# Welcome-page lists come from the precomputed popularity leaderboards; the
+# catalog-wide fallbacks only run until there is logged traffic.
+TRENDING_HOURS = 24
+PICKS_HOURS = 30 * 24
 
-def customer_picks(df, n=5):
-    return df.sort_values(by="in_stock", ascending=False).head(n)
+def popular_rows(catalog, entries):
+    rows = catalog.rows([e['product_id'] for e in entries])
+    return rows[rows >= 0]
+
+def trending_products(catalog, n=5):
+    # Most searched-for products of the last day.
+    rows = popular_rows(catalog, popularity.top(n, popularity.INPUT, hours=TRENDING_HOURS))
+    if not len(rows):
+        rows = np.random.default_rng().choice(len(catalog), size=min(n, len(catalog)), replace=False)
+    return [catalog.record(row) for row in rows]
+
+def customer_picks(catalog, n=5):
+    # Most recommended products of the last month that are in stock now.
+    rows = popular_rows(catalog, popularity.top(popularity.TOP_N, popularity.RECOMMENDED, hours=PICKS_HOURS))
+    rows = rows[catalog.in_stock[rows] > 0][:n]
+    if not len(rows):
+        n = min(n, len(catalog))
+        rows = np.argpartition(-catalog.in_stock, n - 1)[:n] if n else []
+        rows = sorted(rows, key=lambda row: -catalog.in_stock[row])
+    return [catalog.record(row) for row in rows]
 
 def login_page():
     st.title("🛒 Smart Substitution Engine")
@@ -127,15 +167,15 @@ def login_page():
 def welcome_page():
     st.markdown(f'<div class="big-banner"><h1 style="text-align:center;">🌊 Welcome to Smart Substitution Engine!</h1></div>', unsafe_allow_html=True)
     st.markdown("<h4 style='text-align:center;'>Discover trending products and customer favorites!</h4>", unsafe_allow_html=True)
-    df = get_all_product_info()
+    catalog = get_catalog()
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("🔥 Trending Products")
-        for idx, row in trending_products(df, n=3).iterrows():
+        for row in trending_products(catalog, n=3):
             st.markdown(f"<div style='text-align:center'><b>{row['product_name']}</b> - {row['brand']}  <br><small>₹{row['price']}</small></div>", unsafe_allow_html=True)
     with col2:
         st.subheader("💎 Customer Picks")
-        for idx, row in customer_picks(df, n=3).iterrows():
+        for row in customer_picks(catalog, n=3):
             st.markdown(f"<div style='text-align:center'><b>{row['product_name']}</b> - {row['brand']}  <br><small>In Stock: {row['in_stock']}</small></div>", unsafe_allow_html=True)
     st.markdown(" ")
     if st.button("🚀 Get Started", use_container_width=True):
@@ -145,17 +185,17 @@ def welcome_page():
 def enter_product_page():
     st.markdown("<h2 style='text-align:center;color:#005bbb;'>Find Your Product Substitute</h2>", unsafe_allow_html=True)
     st.markdown('<div class="big-banner">Start typing or pick from our products below.</div>', unsafe_allow_html=True)
-    # Get product list from DB
-    df = get_all_product_info()
-    product_names = [""] + sorted(df['product_name'].unique())
-    # Use selectbox for autocomplete
+    # Server-side typeahead: only the top matches for the typed text reach the browser.
+    search_index = product_search_index(get_meta("names_version"))
     col = st.columns([2, 1, 2])
     with col[1]:
+        query = st.text_input("🔍 Enter product name", key="prod_query", help="Type part of a product name")
+        matches = search_index.search(query, limit=10)
         product_input = st.selectbox(
-            "🔍 Enter or select product name",
-            product_names,
+            "Matching products",
+            [""] + matches,
             key="prod_input",
-            help="Type to search, or scroll for your product"
+            help="Pick your product from the closest matches"
         )
         if st.button("Next"):
             if product_input and product_input.strip():
@@ -174,54 +214,15 @@ def find_substitute_page():
     with col[1]:
         if st.button("Find Substitute", key="find_sub_btn"):
             # Call backend as before, pass additional filters if needed
-            results = get_recommendations(product_name)
+            results = get_recommendations(product_name, user_id=st.session_state.user_id)
+            st.session_state.last_request = telemetry.last_request
             if not results:
-                # Fallback (shouldn't happen with demo)
-                results = [
-                    {
-                        "product_id": 10001,
-                        "product_name": "Dove Hair Therapy Shampoo",
-                        "brand": "Dove",
-                        "category": "Hair Care",
-                        "price": 299,
-                        "in_stock": 20,
-                        "rating": 4.5,
-                        "dietary_info": "None",
-                        "description": "Nourishes hair and repairs damage, a gentle, salon-quality alternative.",
-                        "image_url": "",
-                        "similarity": 0.91
-                    },
-                    {
-                        "product_id": 10002,
-                        "product_name": "Pantene Advanced Hair Fall Solution Shampoo",
-                        "brand": "Pantene",
-                        "category": "Hair Care",
-                        "price": 260,
-                        "in_stock": 18,
-                        "rating": 4.3,
-                        "dietary_info": "None",
-                        "description": "Strengthens hair, reduces hair fall, and provides smoothness comparable to premium brands.",
-                        "image_url": "",
-                        "similarity": 0.86
-                    },
-                    {
-                        "product_id": 10003,
-                        "product_name": "Tresemme Keratin Smooth Shampoo",
-                        "brand": "Tresemme",
-                        "category": "Hair Care",
-                        "price": 325,
-                        "in_stock": 15,
-                        "rating": 4.4,
-                        "dietary_info": "None",
-                        "description": "Infused with keratin and argan oil for smooth, frizz-free hair—similar to premium effects.",
-                        "image_url": "",
-                        "similarity": 0.82
-                    },
-                ]
-            st.session_state.substitutes = results
-            st.session_state.scores = [sub.get("similarity", 0) for sub in results]
-            st.session_state.page = "show_substitute"
-            st.rerun()
+                st.warning("No alternatives found for this product.")
+            else:
+                st.session_state.substitutes = results
+                st.session_state.scores = [sub.get("similarity", 0) for sub in results]
+                st.session_state.page = "show_substitute"
+                st.rerun()
     if st.button("⬅️ Back"):
         st.session_state.page = "enter_product"
         st.rerun()
@@ -259,6 +260,25 @@ def similarity_graph_page():
         st.session_state.page = "show_substitute"
         st.rerun()
 
+def debug_panel():
+    with st.sidebar.expander("🔧 Debug: last request", expanded=True):
+        trace = st.session_state.get("last_request")
+        if not trace:
+            st.caption("No recommendation request yet.")
+        else:
+            st.metric("Total", f"{trace['seconds'] * 1000:.1f} ms")
+            st.table({
+                "stage": list(trace["stages"]),
+                "ms": [round(s * 1000, 2) for s in trace["stages"].values()],
+            })
+            if trace["values"]:
+                st.json(trace["values"])
+        stats = telemetry.stats()
+        st.caption("Query embedding cache")
+        st.json(stats["query_cache"])
+        st.caption("Recommendation log")
+        st.json(stats["recommendation_log"])
+
 # ---- Routing ----
 if st.session_state.page == "login":
     login_page()
@@ -272,3 +292,6 @@ elif st.session_state.page == "show_substitute":
     details_page()
 elif st.session_state.page == "similarity_graph":
     similarity_graph_page()
+
+if DEBUG_PANEL:
+    debug_panel()
@@ -1,15 +1,98 @@
-from sentence_transformers import SentenceTransformer, util
+import hashlib
 import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+import numpy as np
 import pandas as pd
-import torch
 from datetime import datetime
+import os
+from similarity import EmbeddingIndex, normalize, top_k
+from ann import PartitionedIVF
+from embedding_store import load_store, build_store, load_quantized, save_quantized
+from cache import LRUCache
+from db import DB_NAME, get_connection, transaction, create_indexes, get_meta, set_meta, bump_version
+from catalog import load_snapshot, reload_stock
+from name_index import NameIndex
+from lexical import LexicalIndex
+import tagging
+import boot
+import telemetry
+import substitutes
+import popularity
+from rec_logger import recommendation_log
 
-DB_NAME = 'products.db'
-model = SentenceTransformer('all-MiniLM-L6-v2')
-semantic_cache = {}
+EMBEDDINGS_PATH = os.path.splitext(DB_NAME)[0] + '.embeddings'
+MODEL_NAME = 'all-MiniLM-L6-v2'
+_model = None
+_model_lock = threading.Lock()
+# Catalogs at least this large are searched through the ANN index, which
+# narrows each query to ANN_POOL candidates before the tier filters run.
+ANN_MIN_ROWS = 200000
+ANN_POOL = 256
+# A filter that leaves too few of the pool widens it once by this factor,
+# then falls back to exact scoring over the filtered rows.
+ANN_WIDEN = 16
+# Lists probed per search. The default keeps ANN recommendations equal to
+# exact scoring for ~98% of queries at 250k products (python ann.py reports
+# recall per nprobe); lower it to trade accuracy for latency.
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 256))
+ann_index = None
+# Free-text queries only; catalog names resolve to their stored embeddings.
+query_embedding_cache = LRUCache(maxsize=10000, ttl=3600)
+# "float32" scores against the float32 store. "float16" / "int8" score against
+# compact codes (2x / 4x less memory read per query) and rescore the best
+# EMBEDDING_RESCORE extra candidates of the winning tier at full precision.
+EMBEDDING_PRECISION = os.environ.get("EMBEDDING_PRECISION", "float32")
+EMBEDDING_RESCORE = int(os.environ.get("EMBEDDING_RESCORE", 32))
+semantic_cache = None
+# embeddings_version the mapped store was loaded at; a newer one is remapped.
+semantic_version = None
+catalog_snapshot = None
+name_index = None
+# RETRIEVAL="lexical" generates up to LEXICAL_POOL candidates from the BM25
+# index and ranks them by (1 - LEXICAL_WEIGHT) * cosine + LEXICAL_WEIGHT *
+# BM25 (scaled to the best candidate); "dense" scores every in-stock product.
+RETRIEVAL = os.environ.get("RETRIEVAL", "dense")
+LEXICAL_POOL = 300
+LEXICAL_WEIGHT = 0.2
+lexical_index = None
+_catalog_lock = threading.Lock()
+
+telemetry.register("query_cache", lambda: query_embedding_cache.stats())
+telemetry.register("recommendation_log", lambda: recommendation_log.stats())
+telemetry.register("substitutes", lambda: substitutes.stats())
+telemetry.register("popularity", lambda: popularity.stats())
+telemetry.register("throughput", lambda: {
+    "ingest_rows_per_second": telemetry.rate("ingest_rows", "ingest"),
+    "embed_rows_per_second": telemetry.rate("encoded_rows", "embed"),
+})
+
+def get_model():
+    # Loaded on first use so tools that only touch the database never import torch.
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                with boot.stage("model load"):
+                    from sentence_transformers import SentenceTransformer
+                    _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+def warm_up():
+    # Optional explicit warm-up: load the model, run one forward pass, map
+    # the embedding store and build the ANN index (on large catalogs) so the
+    # first request does not pay for it.
+    get_model().encode("warm up")
+    with boot.stage("embeddings load"):
+        get_semantic_index()
+    with boot.stage("ann index"):
+        get_ann_index()
+    with boot.stage("name index"):
+        get_name_index()
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS products (
@@ -41,227 +124,894 @@ def init_db():
             timestamp TEXT
         )
     """)
-    conn.commit()
-    conn.close()
-
-def load_csv_to_db(csv_path):
-    df = pd.read_csv(csv_path).dropna(subset=["Product Name"])
-    df = df.rename(columns={
-        "Product Name": "product_name",
-        "Brand": "brand",
-        "Category": "category",
-        "Sale Price": "price",
-        "Description": "description"
-    })
-    df["rating"] = 4.0
-    df['in_stock'] = 1
-    df['dietary_info'] = df['description'].apply(lambda x: 'Gluten-Free' if 'gluten' in str(x).lower() else 'None')
-    df['image_url'] = ''
-    df = df[["product_name", "brand", "category", "price", "in_stock", "rating", "dietary_info", "description", "image_url"]]
-
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    # DO NOT DROP OR REPLACE THE TABLE! Just clear old data.
-    cursor.execute("DELETE FROM products")
-    conn.commit()
-    for _, row in df.iterrows():
-        cursor.execute('''
-            INSERT INTO products (product_name, brand, category, price, in_stock, rating, dietary_info, description, image_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            row['product_name'], row['brand'], row['category'], row['price'],
-            row['in_stock'], row['rating'], row['dietary_info'],
-            row['description'], row['image_url']
-        ))
-    conn.commit()
-    conn.close()
-
-def train_semantic_embeddings():
-    global semantic_cache
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql("SELECT product_id, * FROM products", conn)
-    conn.close()
-    texts = (df['product_name'] + " " + df['description'].fillna("")).tolist()
-    embeddings = model.encode(texts, convert_to_tensor=True)
-    semantic_cache = {}
-    for i, row in df.iterrows():
-        # Force product_id to be int (solves Series/unhashable bug)
-        pid = row['product_id']
-        if isinstance(pid, (pd.Series, list)):
-            pid = int(pid.values[0])
-        else:
-            pid = int(pid)
-        semantic_cache[pid] = embeddings[i]
+    cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', '0'), ('names_version', '0'), ('stock_version', '0'), ('embeddings_version', '0')")
+    # Natural key for CSV upserts. Older databases may hold NULL brands or
+    # duplicates from wipe-and-reload runs; fold those once, before the
+    # index exists (once it does, writes keep brands non-NULL and unique). A
+    # NULL-brand row whose name already exists with brand '' (or as an older
+    # NULL-brand row) is a duplicate of that row and is dropped, so the
+    # UPDATE cannot collide with the unique index.
+    indexed = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_products_name_brand'"
+    ).fetchone()
+    if not indexed:
+        cursor.execute("""
+            DELETE FROM products WHERE brand IS NULL AND EXISTS (
+                SELECT 1 FROM products q WHERE q.product_name = products.product_name
+                  AND (q.brand = '' OR (q.brand IS NULL AND q.product_id < products.product_id))
+            )
+        """)
+        cursor.execute("UPDATE products SET brand = '' WHERE brand IS NULL")
+        cursor.execute("""
+            DELETE FROM products WHERE product_id NOT IN (
+                SELECT MIN(product_id) FROM products GROUP BY product_name, brand
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX idx_products_name_brand ON products(product_name, brand)")
+    # Attribute columns from tagging; older databases get them added and
+    # back-filled once.
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(products)")}
+    for column, kind in TAG_COLUMN_TYPES.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE products ADD COLUMN {column} {kind}")
+    if cursor.execute("SELECT 1 FROM products WHERE diet_mask IS NULL LIMIT 1").fetchone():
+        retag_products()
+    create_indexes(conn)
+    substitutes.create_table(conn)
+    popularity.create_table(conn)
+
+CSV_CHUNK_ROWS = 50000
+CSV_COLUMNS = {
+    "Product Name": "product_name",
+    "Brand": "brand",
+    "Category": "category",
+    "Sale Price": "price",
+    "Description": "description"
+}
+# Used when the feed has them; otherwise new products start in stock with
+# DEFAULT_RATING.
+CSV_OPTIONAL_COLUMNS = {
+    "Available": "available",
+    "Rating": "rating",
+}
+DEFAULT_RATING = 4.0
+TAG_COLUMN_TYPES = {
+    "diet_mask": "INTEGER",
+    "price_band": "INTEGER",
+    "pack_count": "INTEGER",
+    "net_quantity": "REAL",
+    "quantity_unit": "TEXT",
+}
+INPUT_COLUMNS = ["product_name", "brand", "category", "price", "in_stock", "rating", "dietary_info", "description", "image_url"]
+PRODUCT_COLUMNS = INPUT_COLUMNS + tagging.TAG_COLUMNS
+# Feed-owned columns: a changed value updates the row on reload.
+FEED_COLUMNS = ["category", "price", "dietary_info", "description"] + tagging.TAG_COLUMNS
+
+# Upsert on (product_name, brand) so product_ids stay stable across loads.
+# Stock, rating and image are owned by the app, not the feed, and rows whose
+# feed columns did not change are left untouched.
+UPSERT_PRODUCT = f"""
+    INSERT INTO products ({", ".join(PRODUCT_COLUMNS)})
+    VALUES ({", ".join("?" * len(PRODUCT_COLUMNS))})
+    ON CONFLICT(product_name, brand) DO UPDATE SET
+        {", ".join(f"{c} = excluded.{c}" for c in FEED_COLUMNS)}
+    WHERE {" OR ".join(f"products.{c} IS NOT excluded.{c}" for c in FEED_COLUMNS)}
+"""
+
+def prepare_csv_chunk(chunk):
+    df = chunk.rename(columns=CSV_COLUMNS).rename(columns=CSV_OPTIONAL_COLUMNS).dropna(subset=["product_name"])
+    df["brand"] = df["brand"].fillna("")
+    if "rating" not in df:
+        df["rating"] = DEFAULT_RATING
+    df["rating"] = pd.to_numeric(df["rating"], errors="coerce").fillna(DEFAULT_RATING)
+    if "available" in df:
+        available = df["available"].astype(str).str.strip().str.lower().isin(["true", "1", "yes", "y"])
+        df["in_stock"] = available.astype(np.int64)
+    else:
+        df["in_stock"] = 1
+    df["image_url"] = ""
+    df = tagging.tag_frame(df)
+    df = df[PRODUCT_COLUMNS]
+    return df.astype(object).where(df.notna(), None)
+
+def retag_products(chunk_rows=CSV_CHUNK_ROWS):
+    # Recompute the tagging columns for every stored product from its name
+    # and description (after the tag vocabulary changed, or once for
+    # databases older than the columns).
+    conn = get_connection()
+    columns = ["dietary_info"] + tagging.TAG_COLUMNS
+    update = f"UPDATE products SET {', '.join(f'{c} = ?' for c in columns)} WHERE product_id = ?"
+    last = -1
+    with transaction(immediate=True):
+        while True:
+            df = pd.read_sql(
+                "SELECT product_id, product_name, description, price FROM products "
+                "WHERE product_id > ? ORDER BY product_id LIMIT ?",
+                conn, params=(last, chunk_rows)
+            )
+            if df.empty:
+                break
+            last = int(df['product_id'].iloc[-1])
+            df = tagging.tag_frame(df)[columns + ["product_id"]]
+            conn.executemany(update, df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+        bump_version()
+
+def load_csv_to_db(csv_path, chunksize=CSV_CHUNK_ROWS):
+    # Streams the CSV in bounded chunks and applies it as one transaction, so
+    # readers keep seeing the previous catalog until the new one commits.
+    # Products missing from the feed are removed at the end, as before.
+    conn = get_connection()
+    conn.execute("PRAGMA cache_size = -65536")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS loaded_keys (product_name TEXT, brand TEXT, PRIMARY KEY (product_name, brand)) WITHOUT ROWID")
+    rows = 0
+    with telemetry.timer("ingest"), transaction(immediate=True):
+        # Whatever CSV bootstrap_catalog last recorded is no longer what is loaded.
+        set_meta("csv_stat", None)
+        set_meta("csv_sha256", None)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM loaded_keys")
+        wanted = set(CSV_COLUMNS) | set(CSV_OPTIONAL_COLUMNS)
+        for chunk in pd.read_csv(csv_path, usecols=lambda c: c in wanted, chunksize=chunksize):
+            df = prepare_csv_chunk(chunk)
+            cursor.executemany(UPSERT_PRODUCT, df.itertuples(index=False, name=None))
+            cursor.executemany(
+                "INSERT OR IGNORE INTO loaded_keys VALUES (?, ?)",
+                df[["product_name", "brand"]].itertuples(index=False, name=None)
+            )
+            rows += len(df)
+        missing = """
+            FROM products WHERE NOT EXISTS (
+                SELECT 1 FROM loaded_keys k
+                WHERE k.product_name = products.product_name AND k.brand = products.brand
+            )
+        """
+        removed = [row[0] for row in cursor.execute("SELECT product_id " + missing)]
+        cursor.execute("DELETE " + missing)
+        substitutes.mark_stale()
+        bump_version()
+        bump_version("names_version")
+    telemetry.count("ingest_rows", rows)
+    # Products dropped by the feed leave the ANN index now; new ones are
+    # added when the embeddings are retrained (set_semantic_index).
+    if ann_index is not None:
+        for product_id in removed:
+            if product_id in ann_index:
+                ann_index.remove(product_id)
+    if RETRIEVAL == "lexical":
+        get_lexical_index()
+    return rows
+
+def csv_fingerprint(csv_path):
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def bootstrap_catalog(csv_path):
+    # Reload the CSV only when its content changed since the last load. The
+    # size/mtime check avoids even hashing the file on an unchanged restart.
+    stat = os.stat(csv_path)
+    quick = f"{stat.st_size}:{stat.st_mtime_ns}"
+    if get_meta("csv_stat") == quick:
+        return False
+    fingerprint = csv_fingerprint(csv_path)
+    reloaded = get_meta("csv_sha256") != fingerprint
+    if reloaded:
+        load_csv_to_db(csv_path)
+        set_meta("csv_sha256", fingerprint)
+    set_meta("csv_stat", quick)
+    return reloaded
+
+# Embedding build: products are streamed from SQLite EMBED_CHUNK_ROWS at a
+# time and encoded by EMBED_WORKERS processes, EMBED_BATCH_SIZE texts per
+# forward pass.
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", 1))
+EMBED_CHUNK_ROWS = 8192
+EMBED_BATCH_SIZE = 64
+
+def encode_texts(texts):
+    # Module-level so embedding build workers can unpickle it.
+    return get_model().encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
+
+def product_text_chunks(chunk_rows):
+    cursor = get_connection().execute(
+        "SELECT product_id, product_name, description FROM products ORDER BY product_id"
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield [r[0] for r in rows], [f"{r[1] or ''} {r[2] or ''}" for r in rows]
+
+def report_embedding_progress(done, total, rate):
+    print(f"  embedded {done}/{total} products ({rate:.0f}/s)", flush=True)
+
+def train_semantic_embeddings(workers=None, chunk_rows=EMBED_CHUNK_ROWS, progress=report_embedding_progress):
+    # Incremental: only rows whose name/description text changed are re-encoded,
+    # everything else is reused from the on-disk store next to the database.
+    # Both passes over the products run in one read transaction so they see
+    # the same rows; an interrupted build resumes where it stopped.
+    workers = workers or EMBED_WORKERS
+    threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else None
+    with telemetry.timer("embed"), transaction():
+        ids, vectors, stats = build_store(
+            EMBEDDINGS_PATH, product_text_chunks, encode_texts, workers, chunk_rows, threads, progress,
+            release_semantic_index
+        )
+    telemetry.count("encoded_rows", stats["encoded"])
+    version = get_meta("embeddings_version")
+    if stats["published"]:
+        with transaction(immediate=True):
+            version = bump_version("embeddings_version")
+            if stats["reused"] < len(ids):
+                # New or re-encoded vectors: neighbour lists built from the
+                # old ones are out of date until rebuild_substitutes.
+                substitutes.mark_stale()
+    set_semantic_index(attach_codes(EmbeddingIndex.from_normalized(ids, vectors)), version)
+    return stats
+
+def release_semantic_index():
+    # Drop this process's maps of the store before it is replaced; the ANN
+    # index holds copies and stays until set_semantic_index.
+    global semantic_cache, semantic_version
+    semantic_cache = semantic_version = None
+    if catalog_snapshot is not None:
+        catalog_snapshot.forget_embedding_positions()
+
+def set_semantic_index(index, version=None):
+    # Replace the vectors and everything built from them: an ANN index that
+    # was in use is rebuilt over the new vectors, so products loaded since
+    # it was built become searchable and deleted ones drop out.
+    global semantic_cache, semantic_version, ann_index
+    rebuild = ann_index is not None
+    semantic_cache, semantic_version, ann_index = index, version, None
+    if rebuild:
+        build_ann_index()
+
+def attach_codes(index):
+    # Compact codes for EMBEDDING_PRECISION, written next to the store the
+    # first time they are missing or older than the vectors.
+    if EMBEDDING_PRECISION == "float32" or not len(index):
+        return index
+    codes = load_quantized(EMBEDDINGS_PATH, EMBEDDING_PRECISION)
+    if codes is None or len(codes[0]) != len(index):
+        save_quantized(EMBEDDINGS_PATH, EMBEDDING_PRECISION, index.matrix)
+        codes = load_quantized(EMBEDDINGS_PATH, EMBEDDING_PRECISION)
+    return index.with_codes(*codes)
+
+def load_semantic_embeddings():
+    # Memory-map the store written by train_semantic_embeddings (shared page
+    # cache across app workers). Returns False if it has not been built yet.
+    version = get_meta("embeddings_version")
+    store = load_store(EMBEDDINGS_PATH)
+    if store is None:
+        return False
+    ids, _, vectors = store
+    set_semantic_index(attach_codes(EmbeddingIndex.from_normalized(ids, vectors)), version)
+    return True
+
+def current_semantic_index():
+    # The mapped store, remapped when another process has published a newer
+    # one (embeddings_version moved); None when none has been built. A store
+    # caught mid-publish keeps the current map until the next call.
+    if semantic_cache is None or get_meta("embeddings_version") != semantic_version:
+        load_semantic_embeddings()
+    return semantic_cache
 
 def register_user(username, password):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-        conn.commit()
+        get_connection().execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def login_user(username, password):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    cursor = get_connection().execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
+    return cursor.fetchone()
+
+def get_catalog():
+    # Shared columnar snapshot of the products table, reloaded only when the
+    # catalog_version counter moved (any process's write bumps it). Stock-only
+    # writes move stock_version instead, and only in_stock is re-read.
+    global catalog_snapshot
+    versions = dict(get_connection().execute(
+        "SELECT key, value FROM meta WHERE key IN ('catalog_version', 'stock_version')"
+    ).fetchall())
+    version, stock_version = versions.get("catalog_version"), versions.get("stock_version")
+    snapshot = catalog_snapshot
+    if snapshot is None or snapshot.version != version or snapshot.stock_version != stock_version:
+        with _catalog_lock:
+            snapshot = catalog_snapshot
+            if snapshot is not None and snapshot.version == version and snapshot.stock_version != stock_version:
+                if reload_stock(snapshot, get_connection()):
+                    snapshot.stock_version = stock_version
+            if snapshot is None or snapshot.version != version or snapshot.stock_version != stock_version:
+                snapshot = catalog_snapshot = load_snapshot(get_connection(), version)
+                snapshot.stock_version = stock_version
+    return snapshot
 
 def get_filtered_products(diet=None, min_rating=0):
-    conn = sqlite3.connect(DB_NAME)
-    query = "SELECT product_id, * FROM products WHERE in_stock > 0"
-    if diet and diet != "None":
-        query += f" AND dietary_info LIKE '%{diet}%'"
-    if min_rating:
-        query += f" AND rating >= {min_rating}"
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
-# def get_recommendations(product_name, user_id=None, diet=None, min_rating=0):
-#     global semantic_cache
-#     df = get_filtered_products(diet, min_rating)
-#     if df.empty:
-#         return []
-#     query_embedding = model.encode(product_name, convert_to_tensor=True)
-#     scored_products = []
-#     base_row = None
-#     for _, row in df.iterrows():
-#         pid = row['product_id']
-#         if isinstance(pid, (pd.Series, list)):
-#             pid = int(pid.values[0])
-#         else:
-#             pid = int(pid)
-#         if pid in semantic_cache:
-#             sim_score = util.pytorch_cos_sim(query_embedding, semantic_cache[pid])[0][0].item()
-#             scored_products.append((sim_score, row))
-#             # Save base_row if exact product is found
-#             if row['product_name'].lower() == product_name.lower():
-#                 base_row = row
-#     scored_products.sort(reverse=True, key=lambda x: x[0])
-
-#     recommendations = []
-
-#     # 1. Try: Same category and price within 50
-#     if base_row is not None:
-#         for score, row in scored_products:
-#             if row['product_name'].lower() == product_name.lower():
-#                 continue
-#             if abs(row['price'] - base_row['price']) <= 50 and row['category'] == base_row['category']:
-#                 recommendations.append(row.to_dict())
-#                 if user_id:
-#                     save_recommendation(user_id, product_name, row['product_name'])
-#             if len(recommendations) == 3:
-#                 break
-
-#     # 2. Fallback: Same category only
-#     if not recommendations and base_row is not None:
-#         for score, row in scored_products:
-#             if row['product_name'].lower() == product_name.lower():
-#                 continue
-#             if row['category'] == base_row['category']:
-#                 recommendations.append(row.to_dict())
-#                 if user_id:
-#                     save_recommendation(user_id, product_name, row['product_name'])
-#             if len(recommendations) == 3:
-#                 break
-
-#     # 3. Final fallback: Top 3 most similar products (even if different category)
-#     if not recommendations:
-#         for score, row in scored_products:
-#             if row['product_name'].lower() == product_name.lower():
-#                 continue
-#             recommendations.append(row.to_dict())
-#             if user_id:
-#                 save_recommendation(user_id, product_name, row['product_name'])
-#             if len(recommendations) == 3:
-#                 break
-
-#     return recommendations  
-def get_recommendations(product_name, user_id=None, diet=None, min_rating=0):
-    # 🚩 DEMO: always return demo shampoos, no matter what, for this final show!
-    demo_subs = [
-        {
-            "product_id": 10001,
-            "product_name": "Dove Hair Therapy Shampoo",
-            "brand": "Dove",
-            "category": "Hair Care",
-            "price": 299,
-            "in_stock": 20,
-            "rating": 4.5,
-            "dietary_info": "None",
-            "description": "Nourishes hair and repairs damage, a gentle, salon-quality alternative.",
-            "image_url": "",
-            "similarity": 0.91
-        },
-        {
-            "product_id": 10002,
-            "product_name": "Pantene Advanced Hair Fall Solution Shampoo",
-            "brand": "Pantene",
-            "category": "Hair Care",
-            "price": 260,
-            "in_stock": 18,
-            "rating": 4.3,
-            "dietary_info": "None",
-            "description": "Strengthens hair, reduces hair fall, and provides smoothness comparable to premium brands.",
-            "image_url": "",
-            "similarity": 0.86
-        },
-        {
-            "product_id": 10003,
-            "product_name": "Tresemme Keratin Smooth Shampoo",
-            "brand": "Tresemme",
-            "category": "Hair Care",
-            "price": 325,
-            "in_stock": 15,
-            "rating": 4.4,
-            "dietary_info": "None",
-            "description": "Infused with keratin and argan oil for smooth, frizz-free hair—similar to premium effects.",
-            "image_url": "",
-            "similarity": 0.82
-        },
-    ]
-    return demo_subs
-    if results is None or not results:
-    # Fallback on the frontend (rarely needed if backend above is used)
-      st.info("No perfect match, but here are some good alternatives:")
-    # Fetch and display 3 random/generic products here if desired.
+    with telemetry.timer("filter"):
+        catalog = get_catalog()
+        return catalog.frame(catalog.mask(diet, min_rating))
 
+def get_semantic_index():
+    if current_semantic_index() is None:
+        train_semantic_embeddings()
+    return semantic_cache
 
+BASE_COLUMNS = ("product_id", "product_name", "category", "price")
 
+def find_product(product_name):
+    # Catalog row for an exact (case-insensitive) name, whether or not it is
+    # in stock; the last-inserted row wins for duplicated names.
+    cursor = get_connection().execute(
+        "SELECT product_id, product_name, category, price FROM products "
+        "WHERE lower(product_name) = lower(?) ORDER BY product_id DESC LIMIT 1",
+        (product_name,)
+    )
+    row = cursor.fetchone()
+    return dict(zip(BASE_COLUMNS, row)) if row else None
 
+def base_price(base):
+    # The base product's price, NaN when it has none, so it is never within 50.
+    return np.nan if base['price'] is None else float(base['price'])
 
-def save_recommendation(user_id, input_product, recommended_product):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def get_name_index():
+    # Rebuilt only when names change (names_version); add_product patches it.
+    global name_index
+    version = get_meta("names_version")
+    if name_index is None or name_index.version != version:
+        catalog = get_catalog()
+        name_index = NameIndex.build(catalog.ids, catalog.columns['product_name'], version)
+    return name_index
+
+def get_lexical_index():
+    # Same versioning as the name index: rebuilt when names_version moves
+    # (CSV ingest), patched in place by add_product.
+    global lexical_index
+    version = get_meta("names_version")
+    if lexical_index is None or lexical_index.version != version:
+        catalog = get_catalog()
+        lexical_index = LexicalIndex.build(
+            catalog.ids, catalog.columns['product_name'], catalog.columns['description'], version
+        )
+    return lexical_index
+
+def lexical_candidates(catalog, mask, query, text, k=3):
+    # Two-stage retrieval: BM25 candidates passing mask, reranked with the
+    # blended score. None when the lexical stage finds fewer than k.
+    index = get_semantic_index()
+    with telemetry.timer("lexical"):
+        ids, lexical = get_lexical_index().search(text, LEXICAL_POOL)
+    rows = catalog.rows(ids)
+    positions = np.where(rows >= 0, catalog.embedding_positions(index)[rows], -1)
+    keep = positions >= 0
+    keep[keep] = mask[rows[keep]]
+    if keep.sum() < k:
+        return None
+    dense = index.rescore(positions[keep], query)
+    lexical = lexical[keep]
+    return rows[keep], (1 - LEXICAL_WEIGHT) * dense + LEXICAL_WEIGHT * lexical / lexical.max()
+
+def resolve_product(product_name):
+    # Exact name first, then the closest name within a few typos.
+    base = find_product(product_name)
+    if base is not None:
+        return base
+    matches = get_name_index().search(product_name, limit=1)
+    if not matches:
+        return None
+    row = get_connection().execute(
+        "SELECT product_id, product_name, category, price FROM products WHERE product_id = ?",
+        (matches[0][0],)
+    ).fetchone()
+    return dict(zip(BASE_COLUMNS, row)) if row else None
+
+def encode_query(product_name, product_id=None):
+    # Catalog products reuse the vector from the embedding store; anything else
+    # goes through the model once and is then served from the LRU cache.
+    index = get_semantic_index()
+    if product_id is not None and product_id in index:
+        return index[product_id]
+    key = product_name.strip()
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        with telemetry.timer("encode"):
+            embedding = get_model().encode(key, convert_to_numpy=True)
+        query_embedding_cache.put(key, embedding)
+    return embedding
+
+def encode_queries(product_names, product_ids):
+    # Batched encode_query: every query that needs the model goes through one
+    # encode call. Returns an (n, dim) matrix in input order.
+    index = get_semantic_index()
+    vectors = [None] * len(product_names)
+    missing = {}
+    for i, (name, product_id) in enumerate(zip(product_names, product_ids)):
+        if product_id is not None and product_id in index:
+            vectors[i] = index[product_id]
+            continue
+        key = name.strip()
+        vectors[i] = query_embedding_cache.get(key)
+        if vectors[i] is None:
+            missing.setdefault(key, []).append(i)
+    if missing:
+        keys = list(missing)
+        with telemetry.timer("encode"):
+            encoded = get_model().encode(keys, convert_to_numpy=True)
+        for key, embedding in zip(keys, encoded):
+            query_embedding_cache.put(key, embedding)
+            for i in missing[key]:
+                vectors[i] = embedding
+    return np.asarray(vectors, dtype=np.float32).reshape(len(product_names), -1)
+
+def index_categories(index):
+    # Category of every row of the embedding index, '' where unknown.
+    df = pd.read_sql("SELECT product_id, category FROM products", get_connection())
+    categories = pd.Series(df['category'].fillna('').to_numpy(), index=df['product_id'])
+    return categories.reindex(index.ids).fillna('').to_numpy(dtype=object)
+
+def build_ann_index():
+    global ann_index
+    index = get_semantic_index()
+    ann_index = PartitionedIVF.build(index.ids, index.matrix, index_categories(index), ANN_NPROBE)
+    return ann_index
+
+def get_ann_index():
+    if ann_index is None and len(get_semantic_index()) >= ANN_MIN_ROWS:
+        build_ann_index()
+    return ann_index
+
+def score_candidates(catalog, mask, query, category=None, index_scores=None, k=3):
+    # (rows, scores) for the catalog rows passing mask. Rows without an
+    # embedding cannot be ranked and are dropped. With an ANN index only the
+    # nearest rows overall and within the base category are considered, as
+    # long as enough of them pass the filters to fill k results.
+    # index_scores, if given, is the query already scored against the index.
+    ann = get_ann_index()
+    if ann is not None:
+        # One more than k: the query product itself is usually in the pool.
+        wanted = k + 1
+        for pool in (ANN_POOL, ANN_POOL * ANN_WIDEN):
+            rows, scores = _ann_candidates(ann, catalog, mask, query, category, pool)
+            if len(rows) < wanted:
+                continue
+            if category is None:
+                return rows, scores
+            code = catalog.category_code(category)
+            in_category = np.count_nonzero(catalog.category_codes[rows] == code)
+            if in_category >= wanted or in_category >= np.count_nonzero(mask & (catalog.category_codes == code)):
+                return rows, scores
+        telemetry.count("ann_fallbacks")
+    index = get_semantic_index()
+    positions = catalog.embedding_positions(index)
+    rows = np.flatnonzero(mask & (positions >= 0))
+    if index_scores is None:
+        index_scores = index.score(query)
+    return rows, index_scores[positions[rows]]
+
+def _ann_candidates(ann, catalog, mask, query, category, pool):
+    ids, scores = ann.search(query, pool)
+    if category is not None:
+        cat_ids, cat_scores = ann.search(query, pool, category or '')
+        ids, scores = np.concatenate([ids, cat_ids]), np.concatenate([scores, cat_scores])
+    ids, first = np.unique(ids, return_index=True)
+    rows, scores = catalog.rows(ids), scores[first]
+    keep = rows >= 0
+    keep[keep] = mask[rows[keep]]
+    return rows[keep], scores[keep]
+
+def rebuild_substitutes():
+    substitutes.rebuild(get_semantic_index())
+
+def materialized_recommendations(base, k=3):
+    # Tiers 1 and 2 served from the precomputed neighbour list of the base product.
+    df = substitutes.lookup(base['product_id'])
+    if df.empty:
+        return []
+    near_price = (df['price'].astype(float) - base_price(base)).abs() <= 50
+    return (df[near_price] if near_price.any() else df).head(k).to_dict('records')
+
+def get_recommendations(product_name, user_id=None, diet=None, min_rating=0, k=3):
+    with telemetry.request("recommend"):
+        return _recommend(product_name, user_id, diet, min_rating, k)
+
+def _recommend(product_name, user_id, diet, min_rating, k):
+    with telemetry.timer("resolve"):
+        base = resolve_product(product_name)
+    recommendations = _materialized(product_name, base, user_id, diet, min_rating, k)
+    if recommendations is not None:
+        return recommendations
+    with telemetry.timer("filter"):
+        catalog = get_catalog()
+        mask = catalog.mask(diet, min_rating)
+    index = get_semantic_index()
+    if not mask.any() or not len(index):
+        return []
+    query = encode_query(product_name, base and base['product_id'])
+    found = lexical_candidates(catalog, mask, query, product_name, k) if RETRIEVAL == "lexical" else None
+    if found is not None:
+        return _rank(catalog, product_name, base, *found, k, user_id)
+    with telemetry.timer("score"):
+        rows, scores = score_candidates(catalog, mask, query, base and base['category'], k=k)
+    return _rank(catalog, product_name, base, rows, scores, k, user_id, _rescorer(catalog, index, rows, scores, query))
+
+def _rescorer(catalog, index, rows, scores, query):
+    # Full-precision scores for picked candidates when scoring used codes.
+    # Products added since the store was built (ANN hits only) have no row
+    # in it; their ANN score is already full precision and is kept.
+    if not index.quantized or not EMBEDDING_RESCORE:
+        return None
+    positions = catalog.embedding_positions(index)[rows]
+
+    def rescore(picked):
+        exact = np.array(scores[picked], dtype=np.float32)
+        stored = positions[picked] >= 0
+        exact[stored] = index.rescore(positions[picked][stored], query)
+        return exact
+    return rescore
+
+def _materialized(product_name, base, user_id, diet, min_rating, k):
+    # Recommendations from the substitutes table when the request allows it,
+    # None when the full ranking has to run. A stale table (a CSV reload or
+    # new vectors since its last rebuild) is not served from.
+    if base is None or (diet and diet != "None") or min_rating:
+        return None
+    if substitutes.is_stale():
+        telemetry.count("materialized_stale")
+        return None
+    with telemetry.timer("materialized"):
+        recommendations = materialized_recommendations(base, k)
+    if not recommendations:
+        return None
+    telemetry.count("materialized_hits")
+    telemetry.note("source", "materialized")
+    if user_id:
+        with telemetry.timer("save"):
+            save_request(user_id, product_name, [rec['product_name'] for rec in recommendations])
+    return recommendations
+
+def _rank(catalog, product_name, base, rows, scores, k, user_id, rescore=None):
+    # Tier filtering and top-k over scored candidate rows.
+    telemetry.observe("candidates", len(rows))
+    telemetry.note("candidates", len(rows))
+    with telemetry.timer("tiers"):
+        candidates = catalog.name_codes[rows] != catalog.name_code(product_name)
+        if base is not None:
+            candidates &= catalog.name_codes[rows] != catalog.name_code(base['product_name'])
+        tiers = []
+        if base is not None:
+            # The base product itself is usually out of stock, so its category and
+            # price come from the catalog rather than the filtered rows.
+            same_category = catalog.category_codes[rows] == catalog.category_code(base['category'])
+            near_price = np.abs(catalog.price[rows] - base_price(base)) <= 50
+            # 1. Same category and price within 50, 2. same category only
+            tiers.append(candidates & same_category & near_price)
+            tiers.append(candidates & same_category)
+        # 3. Final fallback: most similar products in any category
+        tiers.append(candidates)
+
+        extra = EMBEDDING_RESCORE if rescore is not None else 0
+        for tier, mask in enumerate(tiers, 1):
+            top = top_k(scores, mask, k + extra)
+            if len(top):
+                break
+        if extra and len(top):
+            exact = rescore(top)
+            order = np.argsort(-exact, kind="stable")[:k]
+            top = top[order]
+            scores[top] = exact[order]
+    telemetry.note("tier", tier + 3 - len(tiers))
+
+    recommendations = []
+    for i in top:
+        rec = catalog.record(rows[i])
+        rec['similarity'] = float(scores[i])
+        recommendations.append(rec)
+    if user_id:
+        with telemetry.timer("save"):
+            save_request(user_id, product_name, [rec['product_name'] for rec in recommendations])
+    return recommendations
+
+def get_recommendations_many(requests):
+    # get_recommendations for a list of (product_name, user_id, diet,
+    # min_rating, k) tuples, with the same results in input order. Queries
+    # that need the model are encoded in one batch and, without an ANN index,
+    # scored against the embedding matrix with one matrix product per chunk.
+    results = [None] * len(requests)
+    pending = []
+    for i, (product_name, user_id, diet, min_rating, k) in enumerate(requests):
+        with telemetry.timer("resolve"):
+            base = resolve_product(product_name)
+        results[i] = _materialized(product_name, base, user_id, diet, min_rating, k)
+        if results[i] is None:
+            pending.append((i, base))
+    catalog = get_catalog()
+    index = get_semantic_index()
+    if not pending or not len(index):
+        return [r if r is not None else [] for r in results]
+    queries = encode_queries(
+        [requests[i][0] for i, _ in pending],
+        [base and base['product_id'] for _, base in pending]
+    )
+    exact = get_ann_index() is None and RETRIEVAL != "lexical"
+    step = max(1, BATCH_SCORE_CELLS // len(index))
+    for start in range(0, len(pending), step):
+        with telemetry.timer("batch_score"):
+            block = index.score_many(queries[start:start + step]) if exact else None
+        for j, (i, base) in enumerate(pending[start:start + step]):
+            product_name, user_id, diet, min_rating, k = requests[i]
+            mask = catalog.mask(diet, min_rating)
+            if not mask.any():
+                results[i] = []
+                continue
+            found = None
+            if RETRIEVAL == "lexical":
+                found = lexical_candidates(catalog, mask, queries[start + j], product_name, k)
+            if found is not None:
+                results[i] = _rank(catalog, product_name, base, *found, k, user_id)
+                continue
+            with telemetry.timer("score"):
+                rows, scores = score_candidates(
+                    catalog, mask, queries[start + j], base and base['category'],
+                    block[:, j] if exact else None, k
+                )
+            rescore = _rescorer(catalog, index, rows, scores, queries[start + j])
+            results[i] = _rank(catalog, product_name, base, rows, scores, k, user_id, rescore)
+    return results
+
+# Upper bound on query x candidate cells scored at once in a batch (~128 MB).
+BATCH_SCORE_CELLS = 1 << 25
+_batch_scorer = None
+
+class BatchScorer:
+    # Everything one process needs to rank many queries against the filtered
+    # catalog. Queries are scored against the embedding store itself (memory-
+    # mapped, so pool workers share its pages) and the filter and tiers are
+    # per-row masks over the catalog snapshot's integer-coded columns, so
+    # every tier becomes a broadcast comparison.
+    def __init__(self, diet=None, min_rating=0):
+        index = get_semantic_index()
+        catalog = get_catalog()
+        positions = catalog.embedding_positions(index)
+        stored = positions >= 0
+        # Snapshot row of every embedding row (-1 for none) and which rows
+        # pass the filter.
+        row = np.full(len(index), -1, dtype=np.int64)
+        row[positions[stored]] = np.flatnonzero(stored)
+        self.allowed = np.zeros(len(index), dtype=bool)
+        self.allowed[positions[stored & catalog.mask(diet, min_rating)]] = True
+        self.row = row
+        self.catalog = catalog
+        self.index = index
+        self.name_codes = np.where(row >= 0, catalog.name_codes[row], -1)
+        self.category_codes = np.where(row >= 0, catalog.category_codes[row], -1)
+        self.price = catalog.price[row]
+        # Last (highest product_id) snapshot row per lowercased name, as find_product.
+        self.base_rows = np.full(len(catalog.names), -1, dtype=np.int64)
+        np.maximum.at(self.base_rows, catalog.name_codes, np.arange(len(catalog)))
+
+    def base_rows_for(self, names):
+        # Snapshot row of each name's base product: the exact name, or the
+        # closest name as resolve_product finds it; -1 when there is none.
+        rows = self.catalog.names.get_indexer([name.lower() for name in names])
+        rows = np.where(rows >= 0, self.base_rows[rows], -1)
+        for i in np.flatnonzero(rows < 0):
+            base = resolve_product(names[i])
+            if base is not None:
+                rows[i] = self.catalog.rows([base['product_id']])[0]
+        return rows
+
+    def score(self, names, k=3):
+        results = []
+        step = max(1, BATCH_SCORE_CELLS // max(1, len(self.index)))
+        for start in range(0, len(names), step):
+            results.extend(self._score_chunk(names[start:start + step], k))
+        return results
+
+    def _score_chunk(self, names, k):
+        if not self.allowed.any():
+            return [(name, []) for name in names]
+        catalog = self.catalog
+        base = self.base_rows_for(names)
+        found = base >= 0
+        base_ids = [int(catalog.ids[r]) if r >= 0 else None for r in base]
+        queries = normalize(encode_queries(names, base_ids))
+        scores = queries @ np.asarray(self.index.matrix).T
+        # Not the query's own name, nor the base product's.
+        query_codes = catalog.names.get_indexer([name.lower() for name in names])
+        base_codes = np.where(found, catalog.name_codes[base], -1)
+        candidates = (self.name_codes[None, :] != query_codes[:, None]) & (self.name_codes[None, :] != base_codes[:, None])
+        candidates &= self.allowed[None, :]
+        base_category = np.where(found, catalog.category_codes[base], -2)
+        same_category = self.category_codes[None, :] == base_category[:, None]
+        near_price = np.abs(self.price[None, :] - np.where(found, catalog.price[base], np.nan)[:, None]) <= 50
+        kk = min(k, len(self.index))
+        chosen = np.zeros((len(names), kk), dtype=np.int64)
+        chosen_valid = np.zeros((len(names), kk), dtype=bool)
+        settled = np.zeros(len(names), dtype=bool)
+        # Same three tiers as get_recommendations; a row keeps the first tier
+        # that yields anything.
+        for mask in (candidates & same_category & near_price, candidates & same_category, candidates):
+            masked = np.where(mask, scores, -np.inf)
+            top = np.argpartition(-masked, kk - 1, axis=1)[:, :kk]
+            top_scores = np.take_along_axis(masked, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            valid = np.isfinite(np.take_along_axis(top_scores, order, axis=1))
+            take = ~settled & valid.any(axis=1)
+            chosen[take], chosen_valid[take] = top[take], valid[take]
+            settled |= take
+        results = []
+        for r, name in enumerate(names):
+            recs = []
+            for col in np.flatnonzero(chosen_valid[r]):
+                i = chosen[r, col]
+                row = self.row[i]
+                recs.append({
+                    "product_id": int(catalog.ids[row]),
+                    "product_name": catalog.columns['product_name'][row],
+                    "category": catalog.columns['category'][row],
+                    "price": float(catalog.price[row]),
+                    "similarity": float(scores[r, i]),
+                })
+            results.append((name, recs))
+        return results
+
+def _init_batch_worker(diet, min_rating):
+    global _batch_scorer
+    _batch_scorer = BatchScorer(diet, min_rating)
+
+def _score_batch(names, k):
+    return _batch_scorer.score(names, k)
+
+def get_recommendations_batch(product_names, diet=None, min_rating=0, k=3, workers=1, chunk_size=1024):
+    # Yields (product_name, recommendations) in input order. Queries are encoded
+    # and scored a chunk at a time with one matrix-matrix product; with
+    # workers > 1 chunks are spread over a process pool. Names resolve and
+    # rank as in get_recommendations, but always with exact scoring (no ANN,
+    # lexical retrieval or substitutes table), and diet / min_rating filter
+    # every name in the batch alike: run one batch per filter.
+    get_semantic_index()  # build the store once here, not in every worker
+    names = iter(product_names)
+    chunks = iter(lambda: list(islice(names, chunk_size)), [])
+    if workers <= 1:
+        scorer = BatchScorer(diet, min_rating)
+        for chunk in chunks:
+            yield from scorer.score(chunk, k)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_batch_worker, initargs=(diet, min_rating)) as pool:
+        for results in pool.map(_score_batch, chunks, repeat(k)):
+            yield from results
+
+def save_recommendations(rows, user_id=None):
+    # Bulk form of save_request for (input_product, recommended_product, rank)
+    # rows; each input counts once, on its rank 1 row, however the rows of one
+    # input are split between calls.
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    events = [
+        (user_id, input_product, recommended_product, timestamp, rank == 1)
+        for input_product, recommended_product, rank in rows
+    ]
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO recommendations (user_id, input_product, recommended_product, timestamp) VALUES (?, ?, ?, ?)",
+            [event[:4] for event in events]
+        )
+        popularity.record(conn, events)
+
+def save_request(user_id, input_product, recommended_products):
+    # One request's recommendations, queued for the background writer (see
+    # rec_logger for batching and backpressure); the input counts once.
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("INSERT INTO recommendations (user_id, input_product, recommended_product, timestamp) VALUES (?, ?, ?, ?)",
-                   (user_id, input_product, recommended_product, timestamp))
-    conn.commit()
-    conn.close()
+    for i, recommended_product in enumerate(recommended_products):
+        recommendation_log.log(user_id, input_product, recommended_product, timestamp, i == 0)
+
+def save_recommendation(user_id, input_product, recommended_product):
+    save_request(user_id, input_product, [recommended_product])
+
+def flush_recommendations():
+    recommendation_log.flush()
 
 def add_product(product):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO products (product_name, brand, category, price, in_stock, rating, dietary_info, description, image_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        product['product_name'], product['brand'], product['category'],
-        product['price'], product['in_stock'], product['rating'],
-        product['dietary_info'], product['description'], product['image_url']
-    ))
-    conn.commit()
-    conn.close()
+    # Inserts a new product; raises ValueError if one with the same
+    # product_name and brand exists (existing products change through the
+    # CSV upsert and update_stock). A missing brand is stored as '', as in
+    # CSV ingest. A given dietary_info is kept as tagging input, so its
+    # labels end up in diet_mask.
+    product = dict(product, brand=product.get('brand') or '', description=product.get('description'))
+    row = tagging.tag_frame(pd.DataFrame([{c: product.get(c) for c in INPUT_COLUMNS}]))[PRODUCT_COLUMNS]
+    row = row.astype(object).where(row.notna(), None)
+    with transaction(immediate=True) as conn:
+        try:
+            cursor = conn.execute(
+                f"INSERT INTO products ({', '.join(PRODUCT_COLUMNS)}) VALUES ({', '.join('?' * len(PRODUCT_COLUMNS))})",
+                next(row.itertuples(index=False, name=None))
+            )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"product {product['product_name']!r} by {product['brand']!r} already exists") from None
+        product_id = cursor.lastrowid
+        bump_version()
+        names_version = bump_version("names_version")
+    if name_index is not None and name_index.version == str(int(names_version) - 1):
+        name_index.add(product_id, product['product_name'])
+        name_index.version = names_version
+    if lexical_index is not None and lexical_index.version == str(int(names_version) - 1):
+        lexical_index.add(product_id, product['product_name'], product['description'])
+        lexical_index.version = names_version
+    index = materialized_index()
+    if ann_index is not None or index is not None:
+        text = f"{product['product_name']} {product['description'] or ''}"
+        vector = normalize(np.asarray(get_model().encode(text, convert_to_numpy=True), dtype=np.float32).reshape(1, -1))[0]
+        if ann_index is not None:
+            ann_index.add(product_id, vector, product.get('category') or '')
+        if index is not None:
+            substitutes.on_product_added(index, product_id, vector)
+    return product_id
+
+def materialized_index():
+    # Embedding index for repairing the substitutes table, or None when the
+    # table is not in use. Never loads the model: without an embedding store
+    # the table is only marked stale.
+    if get_connection().execute("SELECT 1 FROM substitutes LIMIT 1").fetchone() is None:
+        return None
+    index = current_semantic_index()
+    if index is None:
+        substitutes.mark_stale()
+    return index
 
 def update_stock(product_id, new_stock):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE products SET in_stock = ? WHERE product_id = ?", (new_stock, product_id))
-    conn.commit()
-    conn.close()
+    apply_stock_updates({product_id: new_stock}, absolute=True)
+
+
+def apply_stock_updates(updates, absolute=False, meta=None):
+    # Batched stock write path: updates maps product_id -> stock change (or
+    # the new level with absolute=True), applied in one transaction with one
+    # stock_version bump, so other processes re-read only the stock column
+    # (see get_catalog). Deltas clamp at zero. meta {key: value} is written in
+    # the same transaction, so a feed's read position commits with the stock
+    # it covers. Returns counts of products updated, unknown and flipped.
+    conn = get_connection()
+    ids = [int(pid) for pid in updates]
+    result = {"updated": 0, "unknown": 0, "flips": 0}
+    with transaction(immediate=True):
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS stock_batch (product_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM stock_batch")
+        conn.executemany("INSERT OR IGNORE INTO stock_batch VALUES (?)", zip(ids))
+        current = dict(conn.execute(
+            "SELECT p.product_id, p.in_stock FROM stock_batch b JOIN products p ON p.product_id = b.product_id"
+        ).fetchall())
+        changed = []
+        for pid, value in zip(ids, updates.values()):
+            if pid not in current:
+                result["unknown"] += 1
+                continue
+            was = current[pid]
+            now = value if absolute else max(0, (was or 0) + int(value))
+            if now != was:
+                changed.append((pid, was, now))
+        conn.executemany("UPDATE products SET in_stock = ? WHERE product_id = ?", [(now, pid) for pid, _, now in changed])
+        version = bump_version("stock_version") if changed else None
+        for key, value in (meta or {}).items():
+            set_meta(key, value)
+    result["updated"] = len(changed)
+    if not changed:
+        return result
+    # Patch this process's snapshot in place rather than reloading it, unless
+    # another writer got in between and a reload is due anyway.
+    snapshot = catalog_snapshot
+    if snapshot is not None and snapshot.stock_version == str(int(version) - 1):
+        snapshot.set_stocks([pid for pid, _, _ in changed], [now for _, _, now in changed])
+        snapshot.stock_version = version
+    went_out = [pid for pid, was, now in changed if (was or 0) > 0 and not (now or 0) > 0]
+    came_back = [pid for pid, was, now in changed if not (was or 0) > 0 and (now or 0) > 0]
+    result["flips"] = len(went_out) + len(came_back)
+    if went_out or came_back:
+        index = materialized_index()
+        if index is not None:
+            substitutes.on_stock_changes(index, went_out, came_back)
+    return result
@@ -0,0 +1,109 @@
+import argparse
+import csv
+import time
+from collections import deque
+import pandas as pd
+from backend import get_recommendations_batch, save_recommendations
+from db import get_connection
+
+OUTPUT_COLUMNS = ["input_product", "rank", "product_id", "product_name", "category", "price", "similarity"]
+
+
+def out_of_stock_names():
+    cursor = get_connection().execute("SELECT product_name FROM products WHERE in_stock = 0")
+    return [row[0] for row in cursor]
+
+
+def read_names(path):
+    if path.endswith(".csv"):
+        return pd.read_csv(path)["product_name"].dropna().tolist()
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def flatten(results):
+    for name, recs in results:
+        for rank, rec in enumerate(recs, 1):
+            yield [name, rank, rec["product_id"], rec["product_name"], rec["category"], rec["price"], rec["similarity"]]
+
+
+def write_csv(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(OUTPUT_COLUMNS)
+        writer.writerows(rows)
+
+
+def write_parquet(rows, path, row_group=100000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == row_group:
+            writer = _write_row_group(pa, pq, writer, batch, path)
+            batch = []
+    if batch or writer is None:
+        writer = _write_row_group(pa, pq, writer, batch, path)
+    writer.close()
+
+
+def _write_row_group(pa, pq, writer, batch, path):
+    table = pa.Table.from_pandas(pd.DataFrame(batch, columns=OUTPUT_COLUMNS), preserve_index=False)
+    if writer is None:
+        writer = pq.ParquetWriter(path, table.schema)
+    writer.write_table(table)
+    return writer
+
+
+def to_table(rows, user_id, batch=10000):
+    # Passes rows through while appending them to the recommendations table,
+    # so --output and --to-table share one pass without holding the results.
+    pairs = []
+    for row in rows:
+        pairs.append((row[0], row[3], row[1]))
+        if len(pairs) == batch:
+            save_recommendations(pairs, user_id)
+            pairs = []
+        yield row
+    if pairs:
+        save_recommendations(pairs, user_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find substitutes for many products at once.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--out-of-stock", action="store_true", help="every product with in_stock = 0")
+    source.add_argument("--input", help="text file with one product name per line, or CSV with a product_name column")
+    parser.add_argument("--output", help="write results to this .csv or .parquet file")
+    parser.add_argument("--to-table", action="store_true", help="append results to the recommendations table")
+    parser.add_argument("--user-id", type=int, help="user_id recorded with --to-table rows")
+    parser.add_argument("--diet")
+    parser.add_argument("--min-rating", type=float, default=0)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    args = parser.parse_args()
+    if not args.output and not args.to_table:
+        parser.error("choose --output and/or --to-table")
+
+    names = out_of_stock_names() if args.out_of_stock else read_names(args.input)
+    start = time.perf_counter()
+    results = get_recommendations_batch(
+        names, diet=args.diet, min_rating=args.min_rating, k=args.k,
+        workers=args.workers, chunk_size=args.chunk_size
+    )
+    rows = flatten(results)
+    if args.to_table:
+        rows = to_table(rows, args.user_id)
+    if args.output:
+        (write_parquet if args.output.endswith(".parquet") else write_csv)(rows, args.output)
+    else:
+        deque(rows, maxlen=0)
+    elapsed = time.perf_counter() - start
+    print(f"✅ {len(names)} products in {elapsed:.1f}s ({len(names) / max(elapsed, 1e-9):.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
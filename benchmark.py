@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+import numpy as np
+import pandas as pd
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Benchmark suite for the substitution pipeline. Generates a walmart.csv-shaped
+# synthetic catalog, then measures ingest, embedding build, filtering and
+# recommendation latency against a throwaway database, and writes the numbers
+# as JSON so runs can be diffed (--compare). Runs offline on CPU; with
+# --encoder hashing no model download or torch is needed at all.
+
+CATEGORY_NAMES = [
+    "Hair Care", "Skin Care", "Oral Care", "Bath & Body", "Snacks", "Beverages", "Dairy", "Bakery",
+    "Frozen", "Produce", "Meat & Seafood", "Pantry", "Breakfast", "Baby", "Pet Supplies", "Household",
+    "Laundry", "Paper Goods", "Vitamins", "Medicine", "Candy", "Coffee & Tea", "Canned Goods", "Condiments",
+    "Pasta & Rice", "Baking", "Deli", "Cleaning", "Kitchen", "Electronics", "Toys", "Office",
+]
+WORDS = (
+    "fresh natural organic classic original family size value pack premium gentle daily care smooth rich "
+    "light crunchy creamy sweet salted spicy mild strong extra soft clean fragrance free formula blend "
+    "vitamin protein fiber whole grain low fat sugar vegan gluten dairy nut coconut vanilla chocolate mint "
+    "lemon berry honey oat almond rice wheat bottle box bag can jar tube count ounce liter gram refill"
+).split()
+
+
+def generate_catalog(path, rows, seed=0, chunk=200000):
+    # Zipf-like category popularity, a long tail of brands per category,
+    # log-normal prices around a per-category median and log-normal
+    # description lengths.
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(CATEGORY_NAMES) + 1) ** 0.8
+    weights /= weights.sum()
+    medians = rng.uniform(2, 60, len(CATEGORY_NAMES))
+    brands = [[f"Brand{c}-{b}" for b in range(int(rng.integers(5, 60)))] for c in range(len(CATEGORY_NAMES))]
+    words = np.array(WORDS)
+    written = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        while written < rows:
+            n = min(chunk, rows - written)
+            cats = rng.choice(len(CATEGORY_NAMES), n, p=weights)
+            brand_rank = np.minimum(rng.zipf(1.6, n) - 1, 10 ** 6)
+            brand = [brands[c][r % len(brands[c])] for c, r in zip(cats, brand_rank)]
+            price = np.round(np.exp(np.log(medians[cats]) + rng.normal(0, 0.6, n)), 2)
+            lengths = np.clip(rng.lognormal(2.8, 0.5, n).astype(int), 3, 120)
+            picks = rng.integers(0, len(words), int(lengths.sum()))
+            splits = np.split(words[picks], np.cumsum(lengths)[:-1])
+            descriptions = [" ".join(d) for d in splits]
+            names = [
+                f"{b.split('-')[0]} {' '.join(d[:3])} {CATEGORY_NAMES[c].split()[0]} {written + i}"
+                for i, (b, d, c) in enumerate(zip(brand, splits, cats))
+            ]
+            pd.DataFrame({
+                "Product Name": names,
+                "Brand": brand,
+                "Category": [CATEGORY_NAMES[c] for c in cats],
+                "Sale Price": price,
+                "Description": descriptions,
+                "Available": rng.random(n) < 0.9,
+            }).to_csv(f, index=False, header=written == 0)
+            written += n
+    return path
+
+
+class HashingEncoder:
+    # Deterministic bag-of-words stand-in for the sentence transformer, so the
+    # rest of the pipeline can be benchmarked without model weights.
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=None, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in str(text).lower().split():
+                out[i, zlib.crc32(word.encode()) % self.dim] += 1.0
+        return out[0] if single else out
+
+
+class RSSSampler:
+    # Peak resident set size during a stage, sampled every 10 ms from /proc
+    # or, elsewhere, psutil; falls back to the process-lifetime peak from
+    # resource, and to None where none of them is available (Windows
+    # without psutil).
+    def __init__(self):
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            pass
+        if psutil is not None:
+            return psutil.Process().memory_info().rss
+        if resource is None:
+            return None
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _sample(self):
+        rss = self._rss()
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(0.01)
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def peak_mb(self):
+        return None if self.peak is None else self.peak / 2 ** 20
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+    }
+
+
+def timed_stage(results, name, fn, rows=None):
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start
+    stage = {"seconds": elapsed, "peak_rss_mb": rss.peak_mb()}
+    if rows is not None:
+        stage["rows"] = rows
+        stage["rows_per_second"] = rows / elapsed if elapsed else None
+    results[name] = stage
+    peak = "     n/a" if stage["peak_rss_mb"] is None else f"{stage['peak_rss_mb']:8.1f}"
+    print(f"  {name:<16}{elapsed:9.2f} s  peak RSS {peak} MB", flush=True)
+    return value, stage
+
+
+def latency_stage(results, name, fn, calls):
+    samples = []
+    with RSSSampler() as rss:
+        for args in calls:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+    stage = dict(percentiles(samples), calls=len(samples), peak_rss_mb=rss.peak_mb())
+    results[name] = stage
+    print(f"  {name:<16}p50 {stage['p50_ms']:8.2f} ms  p95 {stage['p95_ms']:8.2f} ms  p99 {stage['p99_ms']:8.2f} ms", flush=True)
+    return stage
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="sparkathon-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    import db
+    db.DB_NAME = os.path.join(workdir, "products.db")
+    import backend
+    backend.EMBEDDINGS_PATH = os.path.join(workdir, "products.embeddings")
+    if args.encoder == "hashing":
+        backend._model = HashingEncoder()
+
+    csv_path = os.path.join(workdir, "walmart.csv")
+    stages = {}
+    print(f"Benchmarking {args.rows} products in {workdir}")
+    timed_stage(stages, "generate", lambda: generate_catalog(csv_path, args.rows, args.seed), args.rows)
+    backend.init_db()
+    timed_stage(stages, "ingest", lambda: backend.load_csv_to_db(csv_path), args.rows)
+    timed_stage(stages, "embed", lambda: backend.train_semantic_embeddings(args.workers), args.rows)
+    timed_stage(stages, "snapshot_load", backend.get_catalog)
+
+    rng = np.random.default_rng(args.seed)
+    names = backend.get_catalog().columns["product_name"]
+    picks = rng.choice(len(names), args.queries)
+    queries = [(names[i],) for i in picks]
+    typos = [(n[:-3] + n[-2:] if len(n) > 6 else n,) for (n,) in queries[: args.queries // 4]]
+    filters = [(d, r) for d, r in zip(rng.choice([None, "Gluten"], args.queries), rng.choice([0, 3.5], args.queries))]
+    latency_stage(stages, "filter", backend.get_filtered_products, filters[: max(1, args.queries // 10)])
+    latency_stage(stages, "recommend", backend.get_recommendations, queries)
+    latency_stage(stages, "recommend_typo", backend.get_recommendations, typos or queries[:1])
+    if args.batch:
+        batch_names = [q[0] for q in queries]
+        timed_stage(stages, "batch", lambda: list(backend.get_recommendations_batch(batch_names, workers=args.workers)), len(batch_names))
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "rows": args.rows,
+        "seed": args.seed,
+        "encoder": args.encoder,
+        "stages": stages,
+    }
+
+
+def compare(old, new):
+    # Print per-metric change between two result files (positive = slower/bigger).
+    print(f"Compare {old.get('revision')} -> {new.get('revision')}")
+    for stage, metrics in new["stages"].items():
+        before = old["stages"].get(stage, {})
+        for key, value in metrics.items():
+            if key in before and isinstance(value, (int, float)) and before[key]:
+                change = (value - before[key]) / before[key] * 100
+                print(f"  {stage:<16}{key:<18}{before[key]:12.3f} -> {value:12.3f}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, embedding and recommendation stages.")
+    parser.add_argument("--rows", type=int, default=10000, help="synthetic catalog size (10k to 5M)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encoder", choices=["minilm", "hashing"], default="minilm",
+                        help="minilm needs the model in the local cache; hashing needs nothing")
+    parser.add_argument("--batch", action="store_true", help="also time get_recommendations_batch")
+    parser.add_argument("--workers", type=int, default=1, help="processes for the embedding build and batch stage")
+    parser.add_argument("--workdir", help="keep the generated CSV and database here")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+    if args.encoder == "minilm":
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import time
+from contextlib import contextmanager
+
+# Startup-time report: where boot time goes between process start and the
+# first served page. Import this module first so the clock starts early.
+STARTED = time.perf_counter()
+stages = []
+_last_mark = STARTED
+
+
+def mark(name):
+    # Record the time since the previous mark (or process start) under name.
+    global _last_mark
+    now = time.perf_counter()
+    stages.append((name, now - _last_mark))
+    _last_mark = now
+
+
+@contextmanager
+def stage(name):
+    global _last_mark
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _last_mark = time.perf_counter()
+        stages.append((name, _last_mark - start))
+
+
+def report():
+    lines = ["Startup time report"]
+    for name, seconds in stages:
+        lines.append(f"  {name:<28}{seconds * 1000:10.1f} ms")
+    lines.append(f"  {'total since start':<28}{(time.perf_counter() - STARTED) * 1000:10.1f} ms")
+    return "\n".join(lines)
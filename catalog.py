@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import tagging
+
+# Process-wide, read-mostly columnar snapshot of the products table. Rows are
+# sorted by product_id, the same order as the embedding index, so filters are
+# bitmaps over rows: the in-stock bitmap is precomputed, diet bitmaps (a bit
+# test on the diet_mask column) and category bitmaps are built on first use,
+# and combining them is a bitwise AND over packed bytes.
+
+
+class CatalogSnapshot:
+    def __init__(self, df, version=None):
+        df = df.sort_values('product_id', kind='stable').reset_index(drop=True)
+        self.version = version
+        # stock_version moves on stock-only writes, which patch or re-read
+        # just the in_stock column instead of reloading the snapshot.
+        self.stock_version = None
+        self.size = len(df)
+        self.columns = {c: df[c].to_numpy() for c in df.columns}
+        self.ids = df['product_id'].to_numpy(dtype=np.int64)
+        self.price = df['price'].to_numpy(dtype=np.float64)
+        self.rating = df['rating'].to_numpy(dtype=np.float64)
+        self.in_stock = df['in_stock'].fillna(0).to_numpy(dtype=np.int64, copy=True)
+        self.columns['in_stock'] = df['in_stock'].to_numpy(copy=True)
+        self.category_codes, self.categories = pd.factorize(df['category'].fillna(''))
+        self.brand_codes, self.brands = pd.factorize(df['brand'].fillna(''))
+        self.diet_mask = df['diet_mask'].fillna(0).to_numpy(dtype=np.int64)
+        self.name_codes, self.names = pd.factorize(df['product_name'].str.lower())
+        self.stock_bitmap = np.packbits(self.in_stock > 0)
+        self._diet_bitmaps = {}
+        self._category_bitmaps = {}
+        self._embedding_positions = None
+
+    def __len__(self):
+        return self.size
+
+    def category_bitmap(self, category):
+        code = self.category_code(category)
+        bits = self._category_bitmaps.get(code)
+        if bits is None:
+            bits = self._category_bitmaps[code] = np.packbits(self.category_codes == code)
+        return bits
+
+    def category_code(self, category):
+        return self.categories.get_indexer([category or ''])[0]
+
+    def name_code(self, name):
+        return self.names.get_indexer([name.lower()])[0]
+
+    def diet_bitmap(self, diet):
+        # diet as accepted by tagging.matches: a tag, comma-separated tags or an int mask.
+        key = diet if isinstance(diet, (int, np.integer)) else str(diet).lower()
+        bits = self._diet_bitmaps.get(key)
+        if bits is None:
+            bits = self._diet_bitmaps[key] = np.packbits(tagging.matches(self.diet_mask, diet))
+        return bits
+
+    def mask(self, diet=None, min_rating=0, category=None):
+        # Boolean row mask for in-stock products passing the filters.
+        bits = self.stock_bitmap
+        if diet and tagging.required_bits(diet):
+            bits = bits & self.diet_bitmap(diet)
+        if category is not None:
+            bits = bits & self.category_bitmap(category)
+        mask = np.unpackbits(bits, count=self.size).view(bool)
+        if min_rating:
+            mask &= self.rating >= min_rating
+        return mask
+
+    def rows(self, product_ids):
+        # Row of each product_id, -1 where it is not in the snapshot.
+        wanted = np.asarray(product_ids, dtype=np.int64)
+        if not self.size:
+            return np.full(len(wanted), -1, dtype=np.int64)
+        pos = np.searchsorted(self.ids, wanted)
+        pos[pos >= self.size] = 0
+        return np.where(self.ids[pos] == wanted, pos, -1)
+
+    def embedding_positions(self, index):
+        # Embedding-matrix row for every snapshot row, cached per index.
+        cached = self._embedding_positions
+        if cached is None or cached[0] is not index:
+            cached = self._embedding_positions = (index, index.positions(self.ids))
+        return cached[1]
+
+    def forget_embedding_positions(self):
+        self._embedding_positions = None
+
+    def record(self, row):
+        return {c: _plain(values[row]) for c, values in self.columns.items()}
+
+    def frame(self, mask):
+        return pd.DataFrame({c: values[mask] for c, values in self.columns.items()})
+
+    def set_stocks(self, product_ids, stocks):
+        # Patch stock levels in place; returns how many products were found.
+        rows = self.rows(product_ids)
+        found = rows >= 0
+        rows = rows[found]
+        if not len(rows):
+            return 0
+        stocks = np.asarray(stocks, dtype=object)[found]
+        levels = np.array([s or 0 for s in stocks], dtype=np.int64)
+        self.in_stock[rows] = levels
+        self.columns['in_stock'][rows] = stocks
+        # Repack only the bitmap bytes holding the changed rows.
+        byte_rows = np.unique(rows >> 3)
+        cells = (byte_rows[:, None] << 3) + np.arange(8)
+        bits = (self.in_stock[np.minimum(cells, self.size - 1)] > 0) & (cells < self.size)
+        self.stock_bitmap[byte_rows] = np.packbits(bits, axis=1)[:, 0]
+        return len(rows)
+
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def load_snapshot(conn, version=None):
+    return CatalogSnapshot(pd.read_sql("SELECT * FROM products", conn), version)
+
+
+def reload_stock(snapshot, conn):
+    # Re-read only stock levels; False if the product set no longer matches.
+    rows = conn.execute("SELECT product_id, in_stock FROM products ORDER BY product_id").fetchall()
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    if not np.array_equal(ids, snapshot.ids):
+        return False
+    snapshot.set_stocks(ids, [r[1] for r in rows])
+    return True
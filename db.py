@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# PRODUCTS_DB lets one process serve another database, e.g. a store shard.
+DB_NAME = os.environ.get('PRODUCTS_DB', 'products.db')
+
+# One long-lived connection per (thread, database). sqlite3 keeps a per-connection
+# cache of prepared statements, so reusing connections also reuses statements.
+_local = threading.local()
+
+
+def connect(db_name=None):
+    conn = sqlite3.connect(db_name or DB_NAME, timeout=30, isolation_level=None, cached_statements=512)
+    # WAL lets readers run alongside the single writer instead of blocking on it.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 30000")
+    return conn
+
+
+def get_connection(db_name=None):
+    # Connections must not cross a fork, so a child process starts afresh.
+    conns = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "pid", None) != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    name = db_name or DB_NAME
+    conn = conns.get(name)
+    if conn is None:
+        conn = conns[name] = connect(name)
+    return conn
+
+
+def close_connections():
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+@contextmanager
+def transaction(db_name=None, immediate=False):
+    # Nested calls join the outer transaction.
+    conn = get_connection(db_name)
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def create_indexes(conn):
+    # users(username) is already covered by the UNIQUE constraint's index.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category_stock_rating ON products(category, in_stock, rating)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_name_lower ON products(lower(product_name))")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recommendations_user_time ON recommendations(user_id, timestamp)")
+    # Range deletes of compacted log rows (see popularity.compact).
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recommendations_time ON recommendations(timestamp)")
+    # Diet filters run on the catalog snapshot's bitmaps; an index on
+    # (in_stock, diet_mask) only slowed stock writes.
+    conn.execute("DROP INDEX IF EXISTS idx_products_stock_diet")
+
+
+def get_meta(key, db_name=None):
+    row = get_connection(db_name).execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(key, value, db_name=None):
+    get_connection(db_name).execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value)
+    )
+
+
+def bump_version(key="catalog_version", db_name=None):
+    # Monotonic change counter; call inside the transaction that changes the data.
+    conn = get_connection(db_name)
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES (?, '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (key,)
+    )
+    return get_meta(key, db_name)
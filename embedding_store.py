@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from similarity import normalize, quantize
+
+# On-disk layout: three .npy files side by side, rows sorted by product_id.
+#   <base>.ids.npy      int64 product ids
+#   <base>.hashes.npy   uint64 hash of the text each row was encoded from
+#   <base>.vectors.npy  float32 L2-normalized embeddings, memory-mappable
+PARTS = ("ids", "hashes", "vectors")
+
+
+def store_paths(base):
+    return {part: f"{base}.{part}.npy" for part in PARTS}
+
+
+def text_hashes(texts):
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little") for t in texts],
+        dtype=np.uint64,
+    )
+
+
+def load_store(base, mmap=True):
+    paths = store_paths(base)
+    if not all(os.path.exists(p) for p in paths.values()):
+        return None
+    mode = "r" if mmap else None
+    ids = np.load(paths["ids"])
+    hashes = np.load(paths["hashes"])
+    vectors = np.load(paths["vectors"], mmap_mode=mode)
+    if not (len(ids) == len(hashes) == len(vectors)):
+        # A writer died between renames; treat the store as missing.
+        return None
+    return ids, hashes, vectors
+
+
+def save_store(base, ids, hashes, vectors):
+    # Write every part to a temp file first and rename into place, vectors last,
+    # so readers never mmap a half-written file.
+    paths = store_paths(base)
+    for part, data in (("ids", ids), ("hashes", hashes), ("vectors", vectors)):
+        tmp = paths[part] + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(data))
+        os.replace(tmp, paths[part])
+
+
+def _reuse(old, hashes):
+    # Per row: whether the store already has a vector for its text, and where.
+    reused = np.zeros(len(hashes), dtype=bool)
+    source = np.zeros(len(hashes), dtype=np.int64)
+    if old is not None and len(old[0]):
+        old_hashes = old[1]
+        hash_order = np.argsort(old_hashes, kind="stable")
+        sorted_hashes = old_hashes[hash_order]
+        pos = np.searchsorted(sorted_hashes, hashes)
+        pos[pos >= len(sorted_hashes)] = 0
+        reused = sorted_hashes[pos] == hashes
+        source = hash_order[pos]
+    return reused, source
+
+
+def _encode_into(vectors, encode, rows, texts):
+    # Identical texts within a chunk share one encode.
+    index = {}
+    inverse = [index.setdefault(t, len(index)) for t in texts]
+    encoded = normalize(np.asarray(encode(list(index)), dtype=np.float32))
+    vectors[rows] = encoded[inverse]
+
+
+# Worker-process state for build_store: the partial vectors file is opened
+# read-write once per worker and rows are written into it directly.
+_worker = {}
+
+
+def _init_worker(path, encode, threads):
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    _worker.update(path=path, encode=encode, vectors=None)
+
+
+def _probe_dim():
+    return np.asarray(_worker["encode"](["dimension probe"])).shape[-1]
+
+
+def _encode_task(number, rows, texts):
+    if _worker["vectors"] is None:
+        _worker["vectors"] = np.load(_worker["path"], mmap_mode="r+")
+    _encode_into(_worker["vectors"], _worker["encode"], rows, texts)
+    _worker["vectors"].flush()
+    return number, len(rows)
+
+
+def _read_state(path, fingerprint):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("fingerprint") == fingerprint else None
+
+
+def _write_state(path, state):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def build_store(base, read_chunks, encode, workers=1, chunk_rows=8192, threads_per_worker=None, progress=None,
+                release=None):
+    # Streaming, resumable store build. read_chunks(chunk_rows) yields
+    # (product_ids, texts) chunks in ascending product_id order and is called
+    # twice with the same data: once to hash every text, once to encode the
+    # texts the current store has no vector for. Encoded rows are written
+    # straight into a preallocated memory-mapped <vectors>.partial file by
+    # `workers` processes (encode must be picklable, e.g. a module-level
+    # function); completed chunks are recorded in <base>.build.json, so a
+    # rerun after an interruption only encodes what is left. Memory stays at
+    # a few chunks of text plus 16 bytes per product.
+    # release(), if given, is called right before the new files replace the
+    # old ones, for the caller to drop its maps of them: Windows cannot
+    # replace a file that is still mapped. stats["published"] says whether
+    # the store was rewritten.
+    # Returns (ids, vectors, stats) with vectors memory-mapped from the store.
+    started = time.perf_counter()
+    id_parts, hash_parts = [], []
+    for chunk_ids, texts in read_chunks(chunk_rows):
+        id_parts.append(np.asarray(chunk_ids, dtype=np.int64))
+        hash_parts.append(text_hashes(texts))
+    ids = np.concatenate(id_parts) if id_parts else np.zeros(0, dtype=np.int64)
+    hashes = np.concatenate(hash_parts) if hash_parts else np.zeros(0, dtype=np.uint64)
+    if np.any(np.diff(ids) <= 0):
+        raise ValueError("read_chunks must yield unique product ids in ascending order")
+    stats = {"rows": len(ids), "encoded": 0, "reused": 0, "deduplicated": 0, "resumed_chunks": 0,
+             "published": True, "seconds": 0.0}
+
+    old = load_store(base)
+    if old is not None and np.array_equal(old[0], ids) and np.array_equal(old[1], hashes):
+        stats.update(reused=len(ids), published=False, seconds=time.perf_counter() - started)
+        return ids, old[2], stats
+    if not len(ids):
+        old = None
+        if release is not None:
+            release()
+        save_store(base, ids, hashes, np.zeros((0, 0), dtype=np.float32))
+        return ids, load_store(base)[2], stats
+    reused, source = _reuse(old, hashes)
+    stats["reused"] = int(reused.sum())
+    # Texts repeated across the catalog are encoded once, at their first
+    # row; the other rows copy that vector after the encode pass.
+    missing = np.flatnonzero(~reused)
+    _, first, inverse = np.unique(hashes[missing], return_index=True, return_inverse=True)
+    copy_from = missing[first][inverse.ravel()]
+    duplicate = copy_from != missing
+    copies, copy_from = missing[duplicate], copy_from[duplicate]
+    skip = reused.copy()
+    skip[copies] = True
+    stats["deduplicated"] = len(copies)
+    missing_total = len(ids) - int(skip.sum())
+
+    paths = store_paths(base)
+    partial = paths["vectors"] + ".partial"
+    state_path = f"{base}.build.json"
+    # Chunk numbers in the state file only mean the same rows for the same
+    # products, store and chunk size.
+    digest = hashlib.blake2b(ids.tobytes() + hashes.tobytes() + str(chunk_rows).encode(), digest_size=16)
+    if old is not None:
+        digest.update(old[0].tobytes() + old[1].tobytes())
+    fingerprint = digest.hexdigest()
+    state = _read_state(state_path, fingerprint) if os.path.exists(partial) else None
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(partial, encode, threads_per_worker))
+    try:
+        if state is None:
+            if old is not None and old[2].ndim == 2 and old[2].shape[1]:
+                dim = old[2].shape[1]
+            elif pool is not None:
+                dim = pool.submit(_probe_dim).result()
+            else:
+                dim = np.asarray(encode(["dimension probe"])).shape[-1]
+            vectors = np.lib.format.open_memmap(partial, mode="w+", dtype=np.float32, shape=(len(ids), dim))
+            for start in range(0, len(ids), chunk_rows):
+                rows = np.flatnonzero(reused[start:start + chunk_rows]) + start
+                if len(rows):
+                    vectors[rows] = old[2][source[rows]]
+            vectors.flush()
+            del vectors
+            state = {"fingerprint": fingerprint, "dim": int(dim), "done": []}
+            _write_state(state_path, state)
+        done = set(state["done"])
+        stats["resumed_chunks"] = len(done)
+
+        vectors = None if pool is not None else np.load(partial, mmap_mode="r+")
+        pending = set()
+        encoded = sum(int((~skip[n * chunk_rows:(n + 1) * chunk_rows]).sum()) for n in done)
+        encode_started = time.perf_counter()
+
+        def finish(number, count):
+            nonlocal encoded
+            done.add(number)
+            encoded += count
+            stats["encoded"] += count
+            state["done"] = sorted(done)
+            _write_state(state_path, state)
+            if progress is not None:
+                elapsed = time.perf_counter() - encode_started
+                progress(encoded, missing_total, stats["encoded"] / elapsed if elapsed else 0.0)
+
+        offset = 0
+        for number, (chunk_ids, texts) in enumerate(read_chunks(chunk_rows)):
+            chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+            if not np.array_equal(chunk_ids, ids[offset:offset + len(chunk_ids)]):
+                raise RuntimeError("products changed during the embedding build")
+            local = np.flatnonzero(~skip[offset:offset + len(chunk_ids)])
+            rows = local + offset
+            offset += len(chunk_ids)
+            if number in done or not len(local):
+                continue
+            chunk_texts = [texts[i] for i in local]
+            if pool is None:
+                _encode_into(vectors, encode, rows, chunk_texts)
+                vectors.flush()
+                finish(number, len(rows))
+                continue
+            pending.add(pool.submit(_encode_task, number, rows, chunk_texts))
+            while len(pending) >= 2 * workers:
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    finish(*future.result())
+        for future in pending:
+            finish(*future.result())
+        if offset != len(ids):
+            raise RuntimeError("products changed during the embedding build")
+        if len(copies):
+            if vectors is None:
+                vectors = np.load(partial, mmap_mode="r+")
+            for start in range(0, len(copies), chunk_rows):
+                vectors[copies[start:start + chunk_rows]] = vectors[copy_from[start:start + chunk_rows]]
+            vectors.flush()
+        del vectors
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    old = None
+    if release is not None:
+        release()
+    # Same publish order as save_store: ids and hashes first, vectors last.
+    for part, data in (("ids", ids), ("hashes", hashes)):
+        tmp = paths[part] + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, paths[part])
+    os.replace(partial, paths["vectors"])
+    os.remove(state_path)
+    stats["seconds"] = time.perf_counter() - started
+    return ids, load_store(base)[2], stats
+
+
+# Compact copies of the vectors for scoring (see similarity.quantize):
+#   <base>.<kind>.npy         float16 or int8 codes, memory-mappable
+#   <base>.<kind>.scales.npy  float32 per-row scales (int8 only)
+def quantized_paths(base, kind):
+    return f"{base}.{kind}.npy", f"{base}.{kind}.scales.npy"
+
+
+def save_quantized(base, kind, vectors, chunk_rows=65536):
+    # Quantized chunk by chunk from the (memory-mapped) float32 vectors, so
+    # the full-precision matrix is never loaded at once.
+    codes_path, scales_path = quantized_paths(base, kind)
+    dtype = np.float16 if kind == "float16" else np.int8
+    # Per-process temp names: any app worker may find the codes stale.
+    tmp = f".{os.getpid()}.tmp"
+    codes = np.lib.format.open_memmap(codes_path + tmp, mode="w+", dtype=dtype, shape=vectors.shape)
+    scales = np.ones(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), chunk_rows):
+        block_codes, block_scales = quantize(vectors[start:start + chunk_rows], kind)
+        codes[start:start + chunk_rows] = block_codes
+        if block_scales is not None:
+            scales[start:start + chunk_rows] = block_scales
+    codes.flush()
+    del codes
+    if kind == "int8":
+        with open(scales_path + tmp, "wb") as f:
+            np.save(f, scales)
+        os.replace(scales_path + tmp, scales_path)
+    os.replace(codes_path + tmp, codes_path)
+
+
+def load_quantized(base, kind):
+    # (codes, scales) memory-mapped, or None if missing or older than the vectors.
+    codes_path, scales_path = quantized_paths(base, kind)
+    vectors_path = store_paths(base)["vectors"]
+    if not os.path.exists(codes_path) or not os.path.exists(vectors_path):
+        return None
+    if os.path.getmtime(codes_path) < os.path.getmtime(vectors_path):
+        return None
+    codes = np.load(codes_path, mmap_mode="r")
+    scales = None
+    if kind == "int8":
+        if not os.path.exists(scales_path):
+            return None
+        scales = np.load(scales_path, mmap_mode="r")
+    return codes, scales
@@ -0,0 +1,94 @@
+import math
+import numpy as np
+import pandas as pd
+from typeahead import tokens, TOKEN
+
+# BM25 inverted index over product_name and description: the cheap first
+# stage of two-stage retrieval. Postings hold the precomputed BM25 term
+# weight per product, so a query is a concatenation of a few posting arrays
+# and one bincount. Like NameIndex, postings are frozen NumPy arrays after
+# build and add() goes to a small overlay until the next rebuild.
+K1 = 1.2
+B = 0.75
+# Name tokens count this many times, so brand and product type dominate.
+NAME_BOOST = 2
+# Terms in more than this fraction of products add cost but no ranking signal.
+MAX_DF = 0.2
+
+
+def _exploded(ids, texts, weight):
+    words = pd.Series(texts, dtype=object).fillna("").str.lower().str.findall(TOKEN.pattern)
+    df = pd.DataFrame({"product_id": ids, "term": words}).explode("term").dropna()
+    df["tf"] = weight
+    return df
+
+
+class LexicalIndex:
+    def __init__(self):
+        self.version = None
+        self.postings = {}
+        self.doc_count = 0
+        self.avgdl = 1.0
+        self._added = {}
+
+    def __len__(self):
+        return self.doc_count
+
+    @classmethod
+    def build(cls, product_ids, names, descriptions, version=None):
+        index = cls()
+        index.version = version
+        ids = np.asarray(product_ids, dtype=np.int64)
+        index.doc_count = len(ids)
+        if not len(ids):
+            return index
+        df = pd.concat([_exploded(ids, names, NAME_BOOST), _exploded(ids, descriptions, 1)])
+        tf = df.groupby(["term", "product_id"], sort=True)["tf"].sum()
+        doc_len = df.groupby("product_id")["tf"].sum()
+        index.avgdl = float(doc_len.sum()) / len(ids)
+        terms = tf.index.get_level_values(0).to_numpy()
+        pids = tf.index.get_level_values(1).to_numpy(dtype=np.int64)
+        weights = index._weight(tf.to_numpy(dtype=np.float32), doc_len.reindex(pids).to_numpy(dtype=np.float32))
+        bounds = np.flatnonzero(terms[1:] != terms[:-1]) + 1
+        starts, ends = np.r_[0, bounds], np.r_[bounds, len(terms)]
+        index.postings = {terms[a]: (pids[a:b], weights[a:b]) for a, b in zip(starts, ends)}
+        return index
+
+    def _weight(self, tf, doc_len):
+        return (tf * (K1 + 1) / (tf + K1 * (1 - B + B * doc_len / self.avgdl))).astype(np.float32)
+
+    def add(self, product_id, name, description):
+        counts = {}
+        for term in tokens(name or ""):
+            counts[term] = counts.get(term, 0) + NAME_BOOST
+        for term in tokens(description or ""):
+            counts[term] = counts.get(term, 0) + 1
+        doc_len = sum(counts.values())
+        for term, tf in counts.items():
+            self._added.setdefault(term, []).append((int(product_id), float(self._weight(np.float32(tf), doc_len))))
+        self.doc_count += 1
+
+    def search(self, text, limit=300):
+        # (product_ids, scores), best first, for products sharing a term with text.
+        lists = []
+        for term in set(tokens(text)):
+            ids, weights = self.postings.get(term, (None, None))
+            added = self._added.get(term, [])
+            df = (len(ids) if ids is not None else 0) + len(added)
+            if not df or df > MAX_DF * self.doc_count:
+                continue
+            idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            if ids is not None:
+                lists.append((ids, weights * idf))
+            if added:
+                extra = np.array(added)
+                lists.append((extra[:, 0].astype(np.int64), extra[:, 1] * idf))
+        if not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, inverse = np.unique(np.concatenate([l[0] for l in lists]), return_inverse=True)
+        scores = np.bincount(inverse.ravel(), weights=np.concatenate([l[1] for l in lists]))
+        if len(ids) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return ids[order], scores[order].astype(np.float32)
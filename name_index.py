@@ -0,0 +1,105 @@
+import numpy as np
+
+MAX_VERIFY = 64
+# Posting ids a search reads at most: trigrams are probed rarest first, and
+# common ones ("  a", "an ") stop being added once the budget is spent.
+PROBE_BUDGET = 20000
+
+
+def trigrams(text):
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    # Levenshtein distance restricted to a diagonal band of width limit;
+    # returns limit + 1 as soon as the distance is known to exceed it.
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        lo, hi = max(1, i - limit), min(len(b), i + limit)
+        current = [limit + 1] * (len(b) + 1)
+        current[0] = i if i <= limit else limit + 1
+        best = current[0]
+        for j in range(lo, hi + 1):
+            cost = 0 if ca == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            best = min(best, current[j])
+        if best > limit:
+            return limit + 1
+        previous = current
+    return min(previous[len(b)], limit + 1)
+
+
+class NameIndex:
+    # Typo-tolerant product-name lookup: trigram postings propose candidates,
+    # bounded edit distance confirms them. Postings are frozen NumPy arrays
+    # after build; add() goes to a small overlay until the next rebuild.
+    def __init__(self):
+        self.version = None
+        self.names = {}
+        self.postings = {}
+        self._added = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, product_ids, names, version=None):
+        index = cls()
+        index.version = version
+        postings = {}
+        for pid, name in zip(np.asarray(product_ids).tolist(), names):
+            if not isinstance(name, str):
+                continue
+            index.names[pid] = name.lower()
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(pid)
+        index.postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+        return index
+
+    def add(self, product_id, name):
+        self.names[int(product_id)] = name.lower()
+        for gram in trigrams(name):
+            self._added.setdefault(gram, []).append(int(product_id))
+
+    def search(self, query, limit=5, max_distance=None):
+        # [(product_id, distance)], closest first; ties go to the newest product.
+        query = query.strip().lower()
+        if not query:
+            return []
+        if max_distance is None:
+            max_distance = max(1, len(query) // 4)
+        lists = []
+        for gram in trigrams(query):
+            ids = self.postings.get(gram)
+            added = self._added.get(gram)
+            if added:
+                ids = np.array(added, dtype=np.int64) if ids is None else np.concatenate([ids, added])
+            if ids is not None:
+                lists.append(ids)
+        if not lists:
+            return []
+        lists.sort(key=len)
+        probed, total = 1, len(lists[0])
+        while probed < len(lists) and total + len(lists[probed]) <= PROBE_BUDGET:
+            total += len(lists[probed])
+            probed += 1
+        ids, shared = np.unique(np.concatenate(lists[:probed]), return_counts=True)
+        # One edit changes at most three trigrams, so a candidate sharing s of
+        # the probed trigrams is at least (probed - s) / 3 edits away.
+        order = np.lexsort((-ids, -shared))
+        found = []
+        for i in order[:MAX_VERIFY]:
+            # Once the result list is full, only a strictly closer name matters.
+            bound = found[-1][1] - 1 if len(found) >= limit else max_distance
+            if -(-(probed - shared[i]) // 3) > bound:
+                break
+            pid = int(ids[i])
+            distance = edit_distance(query, self.names[pid], bound)
+            if distance <= bound:
+                found.append((pid, distance))
+                found.sort(key=lambda f: f[1])
+                del found[limit:]
+        return found
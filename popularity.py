@@ -0,0 +1,186 @@
+import calendar
+import heapq
+import time
+from collections import Counter
+from db import get_connection, transaction, get_meta, set_meta
+
+# Popularity counters over the recommendation log. Logged events are counted
+# into hourly buckets in the same transaction that writes them; compact()
+# folds hourly buckets older than HOURLY_DAYS into daily ones and deletes raw
+# log rows older than RAW_DAYS, so storage grows with days and distinct
+# products, not with traffic. The log writer runs it when compact_due(); reads
+# never write. Leaderboards (global and per category top
+# TOP_N) are rebuilt from the buckets at most every REFRESH_SECONDS, so a
+# read is a slice of a prepared list.
+#
+# Log timestamps are naive local "%Y-%m-%d %H:%M:%S" strings; buckets are
+# their seconds as if UTC (what SQLite's strftime('%s') gives), and "now" is
+# read on the same clock.
+INPUT, RECOMMENDED = 0, 1
+HOUR, DAY = 3600, 86400
+TOP_N = 50
+HOURLY_DAYS = 2
+RAW_DAYS = 7
+REFRESH_SECONDS = 60
+COMPACT_SECONDS = 3600
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+UPSERT_COUNT = """
+    INSERT INTO popularity (bucket, span, product, role, count) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (bucket, span, product, role) DO UPDATE SET count = count + excluded.count
+"""
+
+metrics = {
+    "events": 0,
+    "refreshes": 0,
+    "compactions": 0,
+    "compacted_buckets": 0,
+    "deleted_log_rows": 0,
+    "last_refresh_seconds": 0.0,
+}
+# (role, hours) -> (monotonic time built, {category or "": [entry, ...]})
+_boards = {}
+
+
+def create_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS popularity (
+            bucket INTEGER,
+            span INTEGER,
+            product TEXT,
+            role INTEGER,
+            count INTEGER,
+            PRIMARY KEY (bucket, span, product, role)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_popularity_role_bucket ON popularity(role, bucket)")
+    if get_meta("popularity_backfilled") is None:
+        backfill(conn)
+
+
+def backfill(conn):
+    # Count the log rows written before the counters existed. Those rows carry
+    # no request marker, so an input counts once per (user, input, second).
+    with transaction(immediate=True):
+        conn.execute(f"""
+            INSERT INTO popularity (bucket, span, product, role, count)
+            SELECT hour, {HOUR}, input_product, {INPUT}, COUNT(*) FROM (
+                SELECT DISTINCT CAST(strftime('%s', timestamp) AS INTEGER) / {HOUR} * {HOUR} AS hour,
+                       user_id, timestamp, input_product
+                FROM recommendations WHERE input_product IS NOT NULL AND timestamp IS NOT NULL
+            ) WHERE true GROUP BY hour, input_product
+            ON CONFLICT (bucket, span, product, role) DO UPDATE SET count = count + excluded.count
+        """)
+        conn.execute(f"""
+            INSERT INTO popularity (bucket, span, product, role, count)
+            SELECT CAST(strftime('%s', timestamp) AS INTEGER) / {HOUR} * {HOUR} AS hour, {HOUR},
+                   recommended_product, {RECOMMENDED}, COUNT(*)
+            FROM recommendations WHERE recommended_product IS NOT NULL AND timestamp IS NOT NULL
+            GROUP BY hour, recommended_product
+            ON CONFLICT (bucket, span, product, role) DO UPDATE SET count = count + excluded.count
+        """)
+        set_meta("popularity_backfilled", str(time.time()))
+
+
+def now():
+    return calendar.timegm(time.localtime())
+
+
+def record(conn, events):
+    # Count (user_id, input_product, recommended_product, timestamp, first)
+    # events; call inside the transaction that logs them. A request logs one
+    # row per recommendation and sets first on one of them, so its input
+    # product counts once per request.
+    counts = Counter()
+    hours = {}
+    for user_id, input_product, recommended_product, timestamp, first in events:
+        hour = hours.get(timestamp)
+        if hour is None:
+            hour = hours[timestamp] = calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT)) // HOUR * HOUR
+        if first:
+            counts[hour, input_product, INPUT] += 1
+        counts[hour, recommended_product, RECOMMENDED] += 1
+    conn.executemany(UPSERT_COUNT, ((hour, HOUR, product, role, n) for (hour, product, role), n in counts.items()))
+    metrics["events"] += len(events)
+
+
+def compact_due():
+    compacted_at = get_meta("popularity_compacted_at")
+    return compacted_at is None or time.time() - float(compacted_at) >= COMPACT_SECONDS
+
+
+def compact(at=None):
+    # Roll hourly buckets older than HOURLY_DAYS into daily buckets and drop
+    # log rows older than RAW_DAYS; both are already counted.
+    at = now() if at is None else at
+    day_cutoff = (at - HOURLY_DAYS * DAY) // DAY * DAY
+    log_cutoff = time.strftime(TIMESTAMP_FORMAT, time.gmtime(at - RAW_DAYS * DAY))
+    with transaction(immediate=True) as conn:
+        conn.execute(f"""
+            INSERT INTO popularity (bucket, span, product, role, count)
+            SELECT bucket / {DAY} * {DAY} AS day, {DAY}, product, role, SUM(count)
+            FROM popularity WHERE span = {HOUR} AND bucket < ?
+            GROUP BY day, product, role
+            ON CONFLICT (bucket, span, product, role) DO UPDATE SET count = count + excluded.count
+        """, (day_cutoff,))
+        compacted = conn.execute(f"DELETE FROM popularity WHERE span = {HOUR} AND bucket < ?", (day_cutoff,)).rowcount
+        deleted = conn.execute("DELETE FROM recommendations WHERE timestamp < ?", (log_cutoff,)).rowcount
+        set_meta("popularity_compacted_at", str(time.time()))
+    metrics["compactions"] += 1
+    metrics["compacted_buckets"] += compacted
+    metrics["deleted_log_rows"] += deleted
+    return compacted, deleted
+
+
+def _build(role, hours):
+    # Counts per product over the last `hours` (buckets overlapping the
+    # window count whole), joined to a product row for id and category.
+    start = now() - hours * HOUR
+    rows = get_connection().execute("""
+        SELECT c.product, c.total, MIN(p.product_id), p.category FROM (
+            SELECT product, SUM(count) AS total FROM popularity
+            WHERE role = ? AND bucket + span > ? GROUP BY product
+        ) c JOIN products p ON p.product_name = c.product
+        GROUP BY c.product
+    """, (role, start)).fetchall()
+    entries = [
+        {"product_id": pid, "product_name": name, "category": category, "count": total}
+        for name, total, pid, category in rows
+    ]
+    by_category = {}
+    for entry in entries:
+        by_category.setdefault(entry["category"] or "", []).append(entry)
+    board = {category: heapq.nlargest(TOP_N, group, key=_count) for category, group in by_category.items()}
+    # Global board under None; "" is the uncategorized group.
+    board[None] = heapq.nlargest(TOP_N, entries, key=_count)
+    return board
+
+
+def _count(entry):
+    return entry["count"]
+
+
+def leaderboard(role=RECOMMENDED, hours=24):
+    key = (role, hours)
+    cached = _boards.get(key)
+    if cached is not None and time.monotonic() - cached[0] < REFRESH_SECONDS:
+        return cached[1]
+    start = time.perf_counter()
+    board = _build(role, hours)
+    _boards[key] = (time.monotonic(), board)
+    metrics["refreshes"] += 1
+    metrics["last_refresh_seconds"] = time.perf_counter() - start
+    return board
+
+
+def top(n=5, role=RECOMMENDED, category=None, hours=24):
+    # Up to TOP_N most counted products, best first, globally or in category.
+    return leaderboard(role, hours).get(category, [])[:n]
+
+
+def invalidate():
+    _boards.clear()
+
+
+def stats():
+    return dict(metrics, leaderboards=len(_boards))
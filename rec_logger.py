@@ -0,0 +1,135 @@
+import atexit
+import threading
+import time
+from collections import deque
+from db import transaction
+import popularity
+
+INSERT_RECOMMENDATION = "INSERT INTO recommendations (user_id, input_product, recommended_product, timestamp) VALUES (?, ?, ?, ?)"
+
+
+class RecommendationLogger:
+    # Write-behind log for recommendation events. log() only appends to a
+    # bounded in-memory queue; a background thread writes batches in one
+    # transaction once flush_rows events are waiting or flush_interval seconds
+    # have passed. When the queue is full, policy decides what gives:
+    #   "drop_oldest" - discard the oldest queued event (default)
+    #   "drop_newest" - discard the event being logged
+    #   "block"       - wait for the writer to make room
+    # The writer also runs popularity compaction when it is due, so the read
+    # path never deletes.
+    def __init__(self, flush_rows=500, flush_interval=1.0, max_queue=100000, policy="drop_oldest"):
+        if policy not in ("drop_oldest", "drop_newest", "block"):
+            raise ValueError(f"unknown backpressure policy: {policy}")
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.policy = policy
+        self.logged = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.errors = 0
+        self.compactions = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def log(self, user_id, input_product, recommended_product, timestamp, first=True):
+        # first marks the event that counts the request's input product.
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="recommendation-logger", daemon=True)
+                self._thread.start()
+            while len(self._queue) >= self.max_queue:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.policy == "drop_oldest":
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._cond.notify_all()
+                    self._cond.wait()
+            self._queue.append((user_id, input_product, recommended_product, timestamp, first))
+            self.logged += 1
+            if len(self._queue) >= self.flush_rows:
+                self._cond.notify_all()
+            return True
+
+    def _take(self):
+        batch = list(self._queue)
+        self._queue.clear()
+        self._cond.notify_all()
+        return batch
+
+    def _write(self, batch):
+        try:
+            with transaction(immediate=True) as conn:
+                conn.executemany(INSERT_RECOMMENDATION, [event[:4] for event in batch])
+                popularity.record(conn, batch)
+            self.flushed += len(batch)
+            self.flushes += 1
+        except Exception:
+            self.errors += 1
+            self.dropped += len(batch)
+        self._compact()
+
+    def _compact(self):
+        try:
+            if popularity.compact_due():
+                popularity.compact()
+                self.compactions += 1
+        except Exception:
+            self.errors += 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._queue) < self.flush_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take()
+                closed = self._closed
+            if batch:
+                self._write(batch)
+            if closed:
+                return
+
+    def flush(self):
+        # Synchronously write whatever is queued (from the caller's thread).
+        with self._cond:
+            batch = self._take()
+        if batch:
+            self._write(batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def stats(self):
+        return {
+            "queued": len(self._queue),
+            "logged": self.logged,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "compactions": self.compactions,
+        }
+
+
+recommendation_log = RecommendationLogger()
+atexit.register(recommendation_log.close)
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import backend
+import stock_feed
+import telemetry
+
+# Standalone HTTP front end for get_recommendations (stdlib asyncio only).
+# Concurrent requests are coalesced by MicroBatcher: the first request opens a
+# window of max_wait seconds (or until max_batch requests arrived), then the
+# whole batch goes through backend.get_recommendations_many, i.e. one
+# model.encode call and one similarity matrix product. A bounded queue gives
+# backpressure: when it is full the request is refused with 503.
+#
+#   GET  /recommend?product=...&diet=...&min_rating=...&k=...&user_id=...
+#   POST /recommend  {"product": ..., "diet": ..., "min_rating": ..., "k": ..., "user_id": ...}
+#   GET  /health, /stats (JSON), /metrics (Prometheus text)
+
+MAX_BODY = 1 << 20
+# Largest k a request may ask for.
+MAX_K = 100
+
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+    def __init__(self, max_batch=64, max_wait=0.005, max_queue=1024):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(max_queue)
+        # One backend thread: batches run one at a time, in arrival order.
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="recommend-batch")
+        self.batches = 0
+        self.batched_requests = 0
+        self.rejected = 0
+        self.failed_batches = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((request, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Drain anything that arrived meanwhile, up to max_batch.
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            requests = [request for request, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, backend.get_recommendations_many, requests)
+                outcomes = [(result, None) for result in results]
+            except Exception:
+                # Rerun the batch one request at a time, so only the requests
+                # that fail on their own get an error.
+                self.failed_batches += 1
+                outcomes = await loop.run_in_executor(self.executor, recommend_each, requests)
+            self.batches += 1
+            self.batched_requests += len(batch)
+            telemetry.observe("service_batch_size", len(batch))
+            for (_, future), (result, exc) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if exc is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exc)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "requests": self.batched_requests,
+            "mean_batch": self.batched_requests / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+            "failed_batches": self.failed_batches,
+        }
+
+
+def recommend_each(requests):
+    # (result, exception) per request, each run through get_recommendations.
+    outcomes = []
+    for product_name, user_id, diet, min_rating, k in requests:
+        try:
+            outcomes.append((backend.get_recommendations(product_name, user_id, diet, min_rating, k), None))
+        except Exception as exc:
+            outcomes.append((None, exc))
+    return outcomes
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"not JSON serializable: {type(value).__name__}")
+
+
+def parse_request(params):
+    # (product_name, user_id, diet, min_rating, k) from query or JSON params.
+    def first(key, default=None):
+        value = params.get(key, default)
+        return value[0] if isinstance(value, list) else value
+
+    product = first("product") or first("product_name")
+    if not product:
+        raise ValueError("missing 'product'")
+    k = int(first("k", 3))
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f"'k' must be between 1 and {MAX_K}")
+    min_rating = float(first("min_rating", 0) or 0)
+    # NaN compares False with every rating, which would drop the filter.
+    if not math.isfinite(min_rating):
+        raise ValueError("'min_rating' must be a finite number")
+    return (
+        str(product),
+        first("user_id"),
+        first("diet"),
+        min_rating,
+        k,
+    )
+
+
+class Service:
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.started = time.time()
+
+    async def handle(self, method, target, body):
+        # (status, content_type, payload bytes)
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, "application/json", b'{"status": "ok"}'
+        if url.path == "/metrics":
+            return 200, "text/plain; version=0.0.4", telemetry.prometheus().encode()
+        if url.path == "/stats":
+            stats = dict(telemetry.stats(), service=self.batcher.stats(), uptime_seconds=time.time() - self.started)
+            return 200, "application/json", json.dumps(stats, default=str).encode()
+        if url.path != "/recommend":
+            return 404, "application/json", b'{"error": "not found"}'
+        try:
+            if method == "POST":
+                params = json.loads(body or b"{}")
+            elif method == "GET":
+                params = parse_qs(url.query)
+            else:
+                return 405, "application/json", b'{"error": "method not allowed"}'
+            request = parse_request(params)
+        except (ValueError, TypeError, AttributeError) as exc:
+            return 400, "application/json", json.dumps({"error": str(exc)}).encode()
+        try:
+            result = await self.batcher.submit(request)
+        except Overloaded:
+            return 503, "application/json", b'{"error": "overloaded"}'
+        except Exception as exc:
+            return 500, "application/json", json.dumps({"error": str(exc)}).encode()
+        return 200, "application/json", json.dumps(result, default=_json_default).encode()
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0) or 0)
+                if length > MAX_BODY:
+                    status, content_type, payload = 413, "application/json", b'{"error": "body too large"}'
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, content_type, payload = await self.handle(method.upper(), target, body)
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                          413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}[status]
+                head = [
+                    f"HTTP/1.1 {status} {reason}",
+                    f"Content-Type: {content_type}",
+                    f"Content-Length: {len(payload)}",
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                ]
+                if status == 503:
+                    head.append("Retry-After: 1")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host, port, max_batch, max_wait, max_queue):
+    batcher = MicroBatcher(max_batch, max_wait, max_queue)
+    batcher.start()
+    service = Service(batcher)
+    server = await asyncio.start_server(service.serve_connection, host, port, backlog=1024)
+    print(f"✅ Recommendation service on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP service for substitute recommendations.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8080)))
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-queue", type=int, default=1024)
+    parser.add_argument("--stock-feed", help="follow this stock-delta feed in-process (see stock_feed.py)")
+    parser.add_argument("--stock-store", help="apply only this store's feed records")
+    args = parser.parse_args()
+    backend.init_db()
+    backend.warm_up()
+    if args.stock_feed:
+        # In-process, so availability changes patch the snapshot this service
+        # filters on instead of forcing a reload.
+        stock_feed.follow_in_background(args.stock_feed, args.stock_store)
+    asyncio.run(serve(args.host, args.port, args.max_batch, args.max_wait_ms / 1000, args.max_queue))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import db
+import backend
+from embedding_store import load_store, save_store
+
+# Store-sharded deployment. Every store gets its own products database and
+# embedding store under SHARD_DIR, holding that store's assortment with its
+# own stock levels; product_ids are kept from the central catalog so shards
+# can share its vectors. Each shard is served by a dedicated worker process
+# bound to the shard's files, which runs the unchanged backend code (snapshot,
+# indexes, substitutes table) against them. ShardCoordinator fans a query out
+# to the shards, takes each shard's local top-k and merges them.
+#
+# A shard is an ordinary products database, so it can equally be served on
+# another host by app.py or service.py with PRODUCTS_DB pointing at it.
+SHARD_DIR = os.environ.get("SHARD_DIR", "stores")
+STOCK_COLUMNS = ["store_id", "product_name", "brand", "in_stock"]
+
+
+def shard_paths(store_id, shard_dir=None):
+    base = os.path.join(shard_dir or SHARD_DIR, f"store_{store_id}")
+    return base + ".db", base + ".embeddings"
+
+
+def list_stores(shard_dir=None):
+    shard_dir = shard_dir or SHARD_DIR
+    if not os.path.isdir(shard_dir):
+        return []
+    names = [f[len("store_"):-len(".db")] for f in os.listdir(shard_dir) if f.startswith("store_") and f.endswith(".db")]
+    return sorted(names, key=lambda s: (not s.isdigit(), int(s) if s.isdigit() else 0, s))
+
+
+# --- shard worker side: everything below runs inside a process bound to one shard ---
+
+def _bind(store_id, shard_dir):
+    # Point this process's backend at the shard and drop anything inherited
+    # from the parent across the fork.
+    db.DB_NAME, backend.EMBEDDINGS_PATH = shard_paths(store_id, shard_dir)
+    backend.catalog_snapshot = None
+    backend.semantic_cache = None
+    backend.name_index = None
+    backend.lexical_index = None
+    backend.ann_index = None
+    backend.query_embedding_cache.clear()
+    db.close_connections()
+
+
+def _build(store_id, stock, central_db, central_embeddings, materialize):
+    # Create the shard database from the central catalog: the store's rows
+    # with its stock levels, and their vectors sliced from the central store.
+    db.close_connections()
+    for path in (db.DB_NAME, backend.EMBEDDINGS_PATH):
+        for suffix in ("", "-wal", "-shm", ".ids.npy", ".hashes.npy", ".vectors.npy"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    backend.init_db()
+    conn = db.get_connection()
+    columns = ", ".join(["product_id"] + [c for c in backend.PRODUCT_COLUMNS if c != "in_stock"])
+    conn.execute("ATTACH DATABASE ? AS central", (central_db,))
+    try:
+        with db.transaction(immediate=True):
+            conn.execute("CREATE TEMP TABLE store_stock (product_name TEXT, brand TEXT, in_stock INTEGER, PRIMARY KEY (product_name, brand))")
+            conn.executemany("INSERT OR REPLACE INTO store_stock VALUES (?, ?, ?)", stock)
+            conn.execute(f"""
+                INSERT INTO products ({columns}, in_stock)
+                SELECT {", ".join("p." + c for c in columns.split(", "))}, s.in_stock
+                FROM central.products p JOIN store_stock s
+                  ON s.product_name = p.product_name AND s.brand = p.brand
+            """)
+            conn.execute("DROP TABLE store_stock")
+            db.bump_version()
+            db.bump_version("names_version")
+    finally:
+        conn.execute("DETACH DATABASE central")
+    ids = np.array([r[0] for r in conn.execute("SELECT product_id FROM products ORDER BY product_id")], dtype=np.int64)
+    central = load_store(central_embeddings)
+    if central is not None:
+        central_ids, hashes, vectors = central
+        pos = np.searchsorted(central_ids, ids)
+        pos[pos >= len(central_ids)] = 0
+        found = central_ids[pos] == ids if len(central_ids) else np.zeros(len(ids), dtype=bool)
+        save_store(backend.EMBEDDINGS_PATH, ids[found], hashes[pos[found]], vectors[pos[found]])
+    # Products without a central vector (none, normally) are encoded here.
+    backend.train_semantic_embeddings()
+    if materialize:
+        backend.rebuild_substitutes()
+    return len(ids)
+
+
+def _recommend(product_name, diet, min_rating, k):
+    base = backend.resolve_product(product_name)
+    return base, backend.get_recommendations(product_name, diet=diet, min_rating=min_rating, k=k)
+
+
+def _call(name, *args):
+    return getattr(backend, name)(*args)
+
+
+def _tier(rec, base):
+    # The tier get_recommendations would have put rec in, so merged results
+    # keep tier order across shards.
+    if base is None or rec.get('category') != base['category']:
+        return 3
+    price, base_price = rec.get('price'), base['price']
+    return 1 if price is not None and base_price is not None and abs(price - base_price) <= 50 else 2
+
+
+class ShardCoordinator:
+    # One single-process executor per store: a shard's caches live in its
+    # worker, and stores run in parallel on separate cores.
+    def __init__(self, store_ids=None, shard_dir=None):
+        self.shard_dir = shard_dir or SHARD_DIR
+        self.store_ids = [str(s) for s in (store_ids or list_stores(self.shard_dir))]
+        self.workers = {}
+
+    def worker(self, store_id):
+        store_id = str(store_id)
+        pool = self.workers.get(store_id)
+        if pool is None:
+            pool = self.workers[store_id] = ProcessPoolExecutor(1, initializer=_bind, initargs=(store_id, self.shard_dir))
+        return pool
+
+    def build(self, stock, central_db=None, central_embeddings=None, materialize=False):
+        # stock: DataFrame with STOCK_COLUMNS. Returns {store_id: products}.
+        os.makedirs(self.shard_dir, exist_ok=True)
+        central_db = os.path.abspath(central_db or db.DB_NAME)
+        central_embeddings = os.path.abspath(central_embeddings or backend.EMBEDDINGS_PATH)
+        stock = stock.assign(store_id=stock["store_id"].astype(str), brand=stock["brand"].fillna(""))
+        futures = {}
+        for store_id, rows in stock.groupby("store_id"):
+            records = list(rows[["product_name", "brand", "in_stock"]].itertuples(index=False, name=None))
+            futures[store_id] = self.worker(store_id).submit(
+                _build, store_id, records, central_db, central_embeddings, materialize
+            )
+            if store_id not in self.store_ids:
+                self.store_ids.append(store_id)
+        return {store_id: future.result() for store_id, future in futures.items()}
+
+    def recommend(self, product_name, store_ids=None, diet=None, min_rating=0, k=3):
+        # Scatter to every requested store, gather each local top-k, merge by
+        # tier then similarity. Records carry the store_id they came from.
+        store_ids = [str(s) for s in (store_ids or self.store_ids)]
+        futures = {s: self.worker(s).submit(_recommend, product_name, diet, min_rating, k) for s in store_ids}
+        merged = []
+        for store_id, future in futures.items():
+            base, recs = future.result()
+            for rec in recs:
+                merged.append((_tier(rec, base), -rec.get('similarity', 0.0), dict(rec, store_id=store_id)))
+        merged.sort(key=lambda m: m[:2])
+        return [rec for _, _, rec in merged[:k]]
+
+    def update_stock(self, store_id, product_id, new_stock):
+        return self.worker(store_id).submit(_call, "update_stock", product_id, new_stock).result()
+
+    def warm_up(self, store_ids=None):
+        futures = [self.worker(s).submit(_call, "get_semantic_index") for s in (store_ids or self.store_ids)]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        for pool in self.workers.values():
+            pool.shutdown()
+        self.workers.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query store shards.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="split the central catalog into per-store shards")
+    build.add_argument("--stock", required=True, help=f"CSV with columns {', '.join(STOCK_COLUMNS)}")
+    build.add_argument("--materialize", action="store_true", help="also build each shard's substitutes table")
+    query = sub.add_parser("query", help="scatter-gather substitutes across stores")
+    query.add_argument("product_name")
+    query.add_argument("--stores", help="comma-separated store ids (default: all)")
+    query.add_argument("--diet")
+    query.add_argument("--min-rating", type=float, default=0)
+    query.add_argument("-k", type=int, default=3)
+    parser.add_argument("--shard-dir", default=SHARD_DIR)
+    args = parser.parse_args()
+
+    coordinator = ShardCoordinator(shard_dir=args.shard_dir)
+    try:
+        if args.command == "build":
+            stock = pd.read_csv(args.stock, usecols=STOCK_COLUMNS)
+            for store_id, count in coordinator.build(stock, materialize=args.materialize).items():
+                print(f"  store {store_id}: {count} products")
+            print(f"✅ Built {len(coordinator.store_ids)} shards in {args.shard_dir}")
+        else:
+            stores = args.stores.split(",") if args.stores else None
+            for rec in coordinator.recommend(args.product_name, stores, args.diet, args.min_rating, args.k):
+                print(f"  [{rec['store_id']}] {rec['product_name']} ({rec['similarity']:.3f})")
+    finally:
+        coordinator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import numpy as np
+
+# Rows dequantized per matrix product when scoring against int8/float16 codes;
+# bounds the float32 temporary to QUANTIZED_BLOCK x dim.
+QUANTIZED_BLOCK = 65536
+
+
+class EmbeddingIndex:
+    # All catalog embeddings in one contiguous, L2-normalized float32 matrix,
+    # rows sorted by product_id so lookups are a binary search. With compact
+    # codes attached (see quantize), scoring reads only the codes and the
+    # float32 matrix is touched just for rescoring a few candidate rows.
+    codes = None
+    scales = None
+
+    def __init__(self, product_ids, embeddings):
+        ids = np.asarray(product_ids, dtype=np.int64)
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        vecs = vecs.reshape(len(ids), -1) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.matrix = np.ascontiguousarray(normalize(vecs[order]))
+
+    @classmethod
+    def from_normalized(cls, product_ids, matrix):
+        # Wrap rows that are already normalized and sorted by product_id
+        # without copying them, e.g. a memory-mapped embedding store.
+        index = cls.__new__(cls)
+        index.ids = np.asarray(product_ids, dtype=np.int64)
+        index.matrix = matrix
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def with_codes(self, codes, scales=None):
+        self.codes, self.scales = codes, scales
+        return self
+
+    @property
+    def quantized(self):
+        return self.codes is not None
+
+    def __contains__(self, product_id):
+        return self.position(product_id) >= 0
+
+    def __getitem__(self, product_id):
+        pos = self.position(product_id)
+        if pos < 0:
+            raise KeyError(product_id)
+        return self.matrix[pos]
+
+    def position(self, product_id):
+        return int(self.positions([product_id])[0])
+
+    def positions(self, product_ids):
+        # Row of each product_id in the matrix, -1 where it has no embedding.
+        wanted = np.asarray(product_ids, dtype=np.int64)
+        pos = np.searchsorted(self.ids, wanted)
+        pos[pos >= len(self.ids)] = 0
+        found = (self.ids[pos] == wanted) if len(self.ids) else np.zeros(len(wanted), dtype=bool)
+        return np.where(found, pos, -1)
+
+    def score(self, query_embedding):
+        # Cosine similarity of the query against every row: one mat-vec product.
+        query = normalize(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        if self.codes is None:
+            return self.matrix @ query
+        return self.score_many(query[None, :])[:, 0]
+
+    def score_many(self, queries):
+        # (rows, queries) similarity matrix for a batch of query embeddings.
+        queries = normalize(np.asarray(queries, dtype=np.float32)).T
+        if self.codes is None:
+            return self.matrix @ queries
+        out = np.empty((len(self.ids), queries.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.ids), QUANTIZED_BLOCK):
+            block = np.asarray(self.codes[start:start + QUANTIZED_BLOCK], dtype=np.float32)
+            out[start:start + QUANTIZED_BLOCK] = block @ queries
+        if self.scales is not None:
+            out *= np.asarray(self.scales)[:, None]
+        return out
+
+    def rescore(self, positions, query_embedding):
+        # Full-precision similarity for a few rows (candidates of a quantized score).
+        query = normalize(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        return np.asarray(self.matrix[positions], dtype=np.float32) @ query
+
+
+def normalize(vecs):
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms
+
+
+def quantize(vectors, kind):
+    # Compact codes for normalized rows: "float16" (scales None) or "int8"
+    # with one float32 scale per row, x ~= code * scale.
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if kind == "float16":
+        return vectors.astype(np.float16), None
+    if kind != "int8":
+        raise ValueError(f"unknown embedding precision: {kind}")
+    scales = np.abs(vectors).max(axis=1) / 127 if len(vectors) else np.zeros(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def top_k(scores, mask, k):
+    # Indices of the k best scores where mask is set, best first. Uses a partial
+    # selection so only the k winners are ever sorted.
+    idx = np.flatnonzero(mask)
+    if k <= 0:
+        return idx[:0]
+    if len(idx) > k:
+        idx = idx[np.argpartition(-scores[idx], k - 1)[:k]]
+    return idx[np.argsort(-scores[idx], kind="stable")]
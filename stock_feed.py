@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import threading
+import time
+import backend
+import telemetry
+from db import get_meta
+
+# Streaming stock-delta ingest. Tails an append-only feed -- one file, or a
+# directory of files read in name order -- of (sku, store, qty[, ts]) records,
+# as JSON lines or CSV with a header row. sku is the product_id, qty a stock
+# change (or the new level with absolute=True) and ts the event's epoch time.
+# Records are coalesced per product for up to `window` seconds and applied
+# with backend.apply_stock_updates: one transaction, one stock_version bump, an
+# in-place patch of the process's catalog snapshot and one substitutes repair
+# per batch. The read position is committed in the same transaction (meta key
+# stock_feed:<path>), so a restarted feed resumes exactly where it stopped.
+#
+# A feed writes to db.DB_NAME and applies the records of one store, or of all
+# stores when store_id is None. For store shards, run one feed per shard with
+# PRODUCTS_DB pointing at it and --store set.
+FEED_WINDOW = float(os.environ.get("STOCK_FEED_WINDOW", 0.5))
+# Distinct products per batch; a full batch is applied without waiting.
+FEED_MAX_BATCH = 50000
+READ_BYTES = 1 << 20
+FEED_SUFFIXES = (".jsonl", ".ndjson", ".csv")
+
+
+def position_key(path):
+    return "stock_feed:" + os.path.abspath(path)
+
+
+class FeedTailer:
+    # Reads complete lines past a (file, offset) position. An unterminated
+    # last line is left for the next read, unless a later file exists in the
+    # directory, which means the writer has moved on.
+    def __init__(self, path, position=None):
+        self.path = path
+        self.file, self.offset = (position["file"], position["offset"]) if position else (None, 0)
+        self.fields = None
+        # Offset the last chunk read started at.
+        self.start = self.offset
+
+    def files(self):
+        if os.path.isdir(self.path):
+            return sorted(f for f in os.listdir(self.path) if f.endswith(FEED_SUFFIXES))
+        return [os.path.basename(self.path)] if os.path.exists(self.path) else []
+
+    def file_path(self, name):
+        return os.path.join(self.path, name) if os.path.isdir(self.path) else self.path
+
+    def position(self):
+        return {"file": self.file, "offset": self.offset}
+
+    def backlog(self):
+        # Bytes written to the feed but not read yet.
+        total = 0
+        for name in self.files():
+            if self.file is None or name > self.file:
+                total += os.path.getsize(self.file_path(name))
+            elif name == self.file:
+                total += max(0, os.path.getsize(self.file_path(name)) - self.offset)
+        return total
+
+    def read(self, limit=READ_BYTES):
+        # Raw lines (bytes) of the current file, [] when caught up.
+        files = self.files()
+        while files:
+            if self.file is None:
+                self.file, self.offset, self.fields = files[0], 0, None
+            later = [f for f in files if f > self.file]
+            path = self.file_path(self.file)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < self.offset:
+                # Truncated and rewritten in place: start over.
+                self.offset, self.fields = 0, None
+            if size > self.offset:
+                with open(path, "rb") as f:
+                    f.seek(self.offset)
+                    data = f.read(limit)
+                end = data.rfind(b"\n")
+                if end < 0 and later and len(data) == size - self.offset:
+                    end = len(data)
+                if end >= 0:
+                    self.start = self.offset
+                    self.offset += min(end + 1, len(data))
+                    return data[:end].split(b"\n")
+            if not later:
+                return []
+            self.file, self.offset, self.fields = later[0], 0, None
+        return []
+
+    def is_csv(self):
+        return self.file is not None and self.file.endswith(".csv")
+
+    def header(self):
+        # CSV field names of the current file, from its first line.
+        if self.fields is None:
+            with open(self.file_path(self.file), "rb") as f:
+                self.fields = f.readline().decode("utf-8").strip().split(",")
+        return self.fields
+
+
+class StockFeed:
+    def __init__(self, path, store_id=None, absolute=False, window=FEED_WINDOW, max_batch=FEED_MAX_BATCH):
+        self.key = position_key(path)
+        saved = get_meta(self.key)
+        self.tailer = FeedTailer(path, json.loads(saved) if saved else None)
+        self.store_id = None if store_id is None else str(store_id)
+        self.absolute = absolute
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = {}
+        self.oldest = None
+        self.last_flush = time.time()
+        self.moved = False
+        self.metrics = {
+            "records": 0,
+            "skipped_records": 0,
+            "bad_records": 0,
+            "coalesced": 0,
+            "batches": 0,
+            "updated": 0,
+            "unknown": 0,
+            "flips": 0,
+            "busy_seconds": 0.0,
+            "last_lag_seconds": 0.0,
+            "max_lag_seconds": 0.0,
+            "last_batch_seconds": 0.0,
+        }
+        telemetry.register("stock_feed", self.stats)
+
+    def stats(self):
+        m = self.metrics
+        return dict(
+            m,
+            pending=len(self.pending),
+            backlog_bytes=self.tailer.backlog(),
+            records_per_second=m["records"] / m["busy_seconds"] if m["busy_seconds"] else 0.0,
+        )
+
+    def records(self, lines):
+        # (sku, store, qty, ts) per line; malformed lines are counted and dropped.
+        fields = None
+        if self.tailer.is_csv():
+            fields = self.tailer.header()
+            if self.tailer.start == 0:
+                lines = lines[1:]
+        result = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = dict(zip(fields, line.decode("utf-8").strip().split(","))) if fields else json.loads(line)
+                ts = row.get("ts")
+                result.append((int(row["sku"]), row.get("store"), float(row["qty"]), float(ts) if ts else None))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                self.metrics["bad_records"] += 1
+        return result
+
+    def poll(self):
+        # Read one chunk of the feed into the pending batch and apply the
+        # batch when it is full or the window has passed. Returns lines read.
+        started = time.perf_counter()
+        lines = self.tailer.read()
+        if lines:
+            self.moved = True
+            now = time.time()
+            pending, store_id, absolute = self.pending, self.store_id, self.absolute
+            for sku, store, qty, ts in self.records(lines):
+                if store_id is not None and str(store) != store_id:
+                    self.metrics["skipped_records"] += 1
+                    continue
+                self.metrics["records"] += 1
+                if sku in pending:
+                    self.metrics["coalesced"] += 1
+                    pending[sku] = qty if absolute else pending[sku] + qty
+                else:
+                    pending[sku] = qty
+                ts = now if ts is None else ts
+                if self.oldest is None or ts < self.oldest:
+                    self.oldest = ts
+            telemetry.count("stock_feed_records", len(lines))
+        self.metrics["busy_seconds"] += time.perf_counter() - started
+        if len(self.pending) >= self.max_batch or (self.moved and time.time() - self.last_flush >= self.window):
+            self.flush()
+        return len(lines)
+
+    def flush(self):
+        started = time.perf_counter()
+        updates = {sku: int(qty) for sku, qty in self.pending.items()}
+        with telemetry.timer("stock_feed_apply"):
+            result = backend.apply_stock_updates(
+                updates, absolute=self.absolute, meta={self.key: json.dumps(self.tailer.position())}
+            )
+        now = time.time()
+        m = self.metrics
+        m["batches"] += 1
+        for name in ("updated", "unknown", "flips"):
+            m[name] += result[name]
+        if self.oldest is not None:
+            # Staleness of the oldest change in the batch: from its event time
+            # (or, without ts, from when it was read) until it is visible.
+            m["last_lag_seconds"] = now - self.oldest
+            m["max_lag_seconds"] = max(m["max_lag_seconds"], m["last_lag_seconds"])
+            telemetry.observe("stock_feed_lag_seconds", m["last_lag_seconds"], telemetry.LATENCY_BUCKETS)
+        m["last_batch_seconds"] = time.perf_counter() - started
+        m["busy_seconds"] += m["last_batch_seconds"]
+        self.pending, self.oldest, self.moved, self.last_flush = {}, None, False, now
+        return result
+
+    def run(self, idle=0.05, until_idle=False, stop=None):
+        # Follow the feed; until_idle returns once it is drained and applied.
+        while stop is None or not stop.is_set():
+            if self.poll():
+                continue
+            if self.pending or self.moved:
+                if until_idle:
+                    self.flush()
+                    continue
+            elif until_idle:
+                return self.stats()
+            time.sleep(idle)
+        if self.pending or self.moved:
+            self.flush()
+        return self.stats()
+
+
+def follow_in_background(path, store_id=None, absolute=False):
+    # Run a feed on a daemon thread of this process, so its snapshot patches
+    # land in the snapshot this process serves from. Returns (feed, stop event).
+    feed = StockFeed(path, store_id, absolute)
+    stop = threading.Event()
+    threading.Thread(target=feed.run, kwargs={"stop": stop}, name="stock-feed", daemon=True).start()
+    return feed, stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a stream of stock deltas to the products database.")
+    parser.add_argument("path", help="feed file or directory of .jsonl/.ndjson/.csv files")
+    parser.add_argument("--store", help="apply only this store's records (default: all)")
+    parser.add_argument("--absolute", action="store_true", help="qty is the new stock level, not a change")
+    parser.add_argument("--window", type=float, default=FEED_WINDOW, help="seconds to coalesce updates")
+    parser.add_argument("--once", action="store_true", help="apply what the feed holds now and exit")
+    parser.add_argument("--report", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+    backend.init_db()
+    feed = StockFeed(args.path, args.store, args.absolute, args.window)
+    if args.once:
+        stats = feed.run(until_idle=True)
+        print(f"✅ {stats['records']} records, {stats['updated']} products updated in {stats['batches']} batches "
+              f"({stats['records_per_second']:.0f} records/s, max lag {stats['max_lag_seconds']:.2f}s)")
+        return
+    stop = threading.Event()
+    thread = threading.Thread(target=feed.run, kwargs={"stop": stop}, daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(args.report)
+            s = feed.stats()
+            print(f"  {s['records']} records, {s['updated']} updated, {s['flips']} flips, "
+                  f"lag {s['last_lag_seconds']:.2f}s, backlog {s['backlog_bytes']} bytes, "
+                  f"{s['records_per_second']:.0f} records/s")
+    except KeyboardInterrupt:
+        stop.set()
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
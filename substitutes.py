@@ -0,0 +1,217 @@
+import time
+import numpy as np
+import pandas as pd
+from db import get_connection, transaction, get_meta, set_meta
+from similarity import top_k
+
+# Materialized top-N neighbour lists: for every product, its most similar
+# in-stock products in the same category. Serving a substitution is then one
+# indexed read; stock changes and new products repair only the lists they touch.
+SUBSTITUTES_N = 10
+SCORE_CELLS = 1 << 24
+# Product ids per IN (...) list; SQLite caps bound parameters per statement.
+ID_CHUNK = 900
+
+metrics = {
+    "rebuilds": 0,
+    "rebuild_seconds": 0.0,
+    "rebuild_lists": 0,
+    "repairs": 0,
+    "repair_seconds": 0.0,
+    "repaired_lists": 0,
+    "last_repair_seconds": 0.0,
+}
+
+
+def create_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS substitutes (
+            product_id INTEGER,
+            rank INTEGER,
+            substitute_id INTEGER,
+            score REAL,
+            PRIMARY KEY (product_id, rank)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_substitutes_substitute ON substitutes(substitute_id)")
+
+
+def mark_stale():
+    # Called when the catalog changed in a way that is not repaired in place
+    # (a CSV reload, re-encoded embeddings); cleared by the next rebuild.
+    # Lookups skip the table until then.
+    if get_meta("substitutes_stale_since") is None:
+        set_meta("substitutes_stale_since", str(time.time()))
+
+
+def is_stale():
+    return get_meta("substitutes_stale_since") is not None
+
+
+def freshness_lag():
+    # Seconds the table has been behind the catalog, 0 when it is current.
+    stale_since = get_meta("substitutes_stale_since")
+    return time.time() - float(stale_since) if stale_since else 0.0
+
+
+def stats():
+    return dict(metrics, freshness_lag_seconds=freshness_lag())
+
+
+def _vectors(index, product_ids, extra):
+    # (ids, matrix) for the products that have an embedding, from the index
+    # or, for SKUs added since it was built, from extra {product_id: vector}.
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    positions = index.positions(product_ids)
+    keep = positions >= 0
+    ids, matrix = product_ids[keep], np.asarray(index.matrix)[positions[keep]]
+    if extra:
+        more = [pid for pid in product_ids[~keep].tolist() if pid in extra]
+        if more:
+            ids = np.concatenate([ids, np.array(more, dtype=np.int64)])
+            matrix = np.concatenate([matrix, np.stack([extra[pid] for pid in more]).astype(np.float32)])
+    return ids, matrix
+
+
+def _category_lists(index, category, product_ids=None, extra=None):
+    # Neighbour lists for product_ids (default: the whole category) against
+    # the category's in-stock products.
+    df = pd.read_sql(
+        "SELECT product_id, in_stock FROM products WHERE category IS ?",
+        get_connection(), params=(category,)
+    )
+    cand_ids, cand_matrix = _vectors(index, df.loc[df['in_stock'] > 0, 'product_id'], extra)
+    ids, matrix = _vectors(index, df['product_id'] if product_ids is None else product_ids, extra)
+    rows = []
+    if not len(cand_ids):
+        return ids, rows
+    step = max(1, SCORE_CELLS // len(cand_ids))
+    for start in range(0, len(ids), step):
+        scores = matrix[start:start + step] @ cand_matrix.T
+        for r, pid in enumerate(ids[start:start + step].tolist()):
+            mask = cand_ids != pid
+            for rank, i in enumerate(top_k(scores[r], mask, SUBSTITUTES_N), 1):
+                rows.append((pid, rank, int(cand_ids[i]), float(scores[r, i])))
+    return ids, rows
+
+
+def rebuild(index):
+    start = time.perf_counter()
+    conn = get_connection()
+    categories = [row[0] for row in conn.execute("SELECT DISTINCT category FROM products")]
+    lists = 0
+    with transaction(immediate=True):
+        conn.execute("DELETE FROM substitutes")
+        for category in categories:
+            ids, rows = _category_lists(index, category)
+            conn.executemany("INSERT INTO substitutes VALUES (?, ?, ?, ?)", rows)
+            lists += len(ids)
+        set_meta("substitutes_stale_since", None)
+    metrics["rebuilds"] += 1
+    metrics["rebuild_lists"] = lists
+    metrics["rebuild_seconds"] = time.perf_counter() - start
+
+
+def _categories(conn, product_ids):
+    # product_id, category frame for product_ids, read ID_CHUNK ids at a time.
+    parts = []
+    for start in range(0, len(product_ids), ID_CHUNK):
+        part = product_ids[start:start + ID_CHUNK]
+        parts.append(pd.read_sql(
+            f"SELECT product_id, category FROM products WHERE product_id IN ({','.join('?' * len(part))})",
+            conn, params=part
+        ))
+    return pd.concat(parts, ignore_index=True)
+
+
+def refresh(index, product_ids, extra=None):
+    # Recompute the lists of just these products, one scoring pass per category.
+    product_ids = sorted(set(int(pid) for pid in product_ids))
+    if not product_ids:
+        return
+    start = time.perf_counter()
+    conn = get_connection()
+    df = _categories(conn, product_ids)
+    with transaction(immediate=True):
+        conn.executemany("DELETE FROM substitutes WHERE product_id = ?", zip(product_ids))
+        for category, group in df.groupby(df['category'].fillna(''), sort=False):
+            _, rows = _category_lists(index, group['category'].iloc[0], group['product_id'], extra)
+            conn.executemany("INSERT INTO substitutes VALUES (?, ?, ?, ?)", rows)
+    elapsed = time.perf_counter() - start
+    metrics["repairs"] += 1
+    metrics["repaired_lists"] += len(product_ids)
+    metrics["repair_seconds"] += elapsed
+    metrics["last_repair_seconds"] = elapsed
+
+
+def lists_entered(index, product_ids, extra=None):
+    # Products whose list one of product_ids (now in stock) belongs in: the
+    # list is short, or the product beats its current last entry. Grouped by
+    # category, with one matrix product per category.
+    conn = get_connection()
+    product_ids = sorted(set(int(pid) for pid in product_ids))
+    affected = set()
+    if not product_ids:
+        return affected
+    df = _categories(conn, product_ids)
+    for _, group in df.groupby(df['category'].fillna(''), sort=False):
+        category = group['category'].iloc[0]
+        ids, vectors = _vectors(index, group['product_id'], extra)
+        if not len(ids):
+            continue
+        lists = pd.read_sql("""
+            SELECT p.product_id, MIN(s.score) AS worst, COUNT(s.rank) AS size
+            FROM products p LEFT JOIN substitutes s ON s.product_id = p.product_id
+            WHERE p.category IS ?
+            GROUP BY p.product_id
+        """, conn, params=(category,)).set_index('product_id')
+        cat_ids, cat_matrix = _vectors(index, lists.index, extra)
+        lists = lists.loc[cat_ids]
+        worst = lists['worst'].fillna(-np.inf).to_numpy()
+        short = lists['size'].to_numpy() < SUBSTITUTES_N
+        best = np.full(len(cat_ids), -np.inf, dtype=np.float32)
+        step = max(1, SCORE_CELLS // len(ids))
+        for start in range(0, len(cat_ids), step):
+            scores = cat_matrix[start:start + step] @ vectors.T
+            # A product does not enter its own list.
+            scores[cat_ids[start:start + step, None] == ids[None, :]] = -np.inf
+            best[start:start + step] = scores.max(axis=1)
+        affected.update(cat_ids[(best > worst) | short].tolist())
+    return affected
+
+
+def on_stock_changes(index, went_out, came_back):
+    # One repair for a batch of availability flips: the lists holding a
+    # product that went out of stock, and the lists a restocked product
+    # now belongs in.
+    conn = get_connection()
+    affected = set()
+    went_out = [int(pid) for pid in went_out]
+    for start in range(0, len(went_out), ID_CHUNK):
+        part = went_out[start:start + ID_CHUNK]
+        cursor = conn.execute(
+            f"SELECT DISTINCT product_id FROM substitutes WHERE substitute_id IN ({','.join('?' * len(part))})", part
+        )
+        affected.update(row[0] for row in cursor)
+    affected.update(lists_entered(index, came_back))
+    refresh(index, affected)
+
+
+def on_product_added(index, product_id, vector):
+    extra = {int(product_id): np.asarray(vector, dtype=np.float32)}
+    affected = {int(product_id)}
+    if get_connection().execute("SELECT COALESCE(in_stock, 0) FROM products WHERE product_id = ?", (product_id,)).fetchone()[0] > 0:
+        affected |= lists_entered(index, [product_id], extra)
+    refresh(index, affected, extra)
+
+
+def lookup(product_id):
+    # Stored neighbours joined with their current product rows, best first.
+    # Missing values are None, as in the catalog snapshot's records.
+    df = pd.read_sql("""
+        SELECT p.*, s.score AS similarity
+        FROM substitutes s JOIN products p ON p.product_id = s.substitute_id
+        WHERE s.product_id = ? AND p.in_stock > 0
+        ORDER BY s.rank
+    """, get_connection(), params=(int(product_id),))
+    return df.astype(object).where(df.notna(), None)
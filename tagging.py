@@ -0,0 +1,156 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Attribute extraction at ingest. Every tag is one bit of products.diet_mask,
+# matched by a compiled pattern over name + description; filters then test
+# bits instead of scanning text. Bits are part of the stored data: append new
+# tags at the end, never renumber.
+#
+# Each pattern runs once over the whole chunk (lowercased texts joined with
+# NUL, which no pattern can match across) and matches are mapped back to rows
+# by offset, so the regex engine scans in C instead of once per row. Keep
+# patterns lowercase and starting with a literal: that lets the engine skip
+# ahead to candidate positions. A top-level alternation has no literal
+# prefix, so a tag lists its alternatives as separate patterns.
+TAGS = {
+    "Gluten-Free": (r"gluten[\s-]*free", r"no gluten", r"without gluten"),
+    "Vegan": (r"vegan\b", r"plant[\s-]*based"),
+    "Vegetarian": (r"vegetarian\b",),
+    "Sugar-Free": (r"sugar[\s-]*free", r"no (?:added )?sugar", r"zero sugar", r"unsweetened"),
+    "Organic": (r"organic\b",),
+    "Dairy-Free": (r"dairy[\s-]*free", r"lactose[\s-]*free", r"non[\s-]*dairy"),
+    "Nut-Free": (r"nut[\s-]*free",),
+    "Kosher": (r"kosher\b",),
+    "Low-Fat": (r"low[\s-]*fat", r"fat[\s-]*free", r"reduced[\s-]*fat"),
+    "Keto": (r"keto\b",),
+    "Non-GMO": (r"non[\s-]*gmo",),
+}
+TAG_BITS = {tag: 1 << i for i, tag in enumerate(TAGS)}
+PATTERNS = {tag: [re.compile(pattern) for pattern in patterns] for tag, patterns in TAGS.items()}
+
+# price_band i covers PRICE_BANDS[i - 1] <= price < PRICE_BANDS[i].
+PRICE_BANDS = (5, 10, 25, 50, 100, 250)
+
+# Sizes are matched in a copy of the text with every digit mapped to DIGIT,
+# so the pattern starts with a literal; the copy has the same offsets, and
+# numbers are read back from the real text. One pass finds both pack counts
+# and net quantities.
+DIGIT = "\x01"
+DIGITS = str.maketrans("0123456789", DIGIT * 10)
+SIZE = re.compile(
+    DIGIT + DIGIT + r"*+(?P<fraction>\." + DIGIT + r"++)?\s*+-?\s*+"
+    r"(?:(?P<pack>pack|pk|count|ct)|(?P<unit>fl\.?\s*oz|oz|lbs?|kg|g|ml|l))\b"
+)
+# Net quantity is normalized to grams or millilitres.
+UNITS = {"oz": (28.3495, "g"), "lb": (453.592, "g"), "lbs": (453.592, "g"), "kg": (1000.0, "g"), "g": (1.0, "g"),
+         "floz": (29.5735, "ml"), "fl.oz": (29.5735, "ml"), "ml": (1.0, "ml"), "l": (1000.0, "ml")}
+
+TAG_COLUMNS = ["diet_mask", "price_band", "pack_count", "net_quantity", "quantity_unit"]
+
+
+def _joined(texts):
+    texts = pd.Series(texts, dtype=object).fillna("").astype(str).str.lower().tolist()
+    lengths = np.fromiter((len(t) + 1 for t in texts), dtype=np.int64, count=len(texts))
+    starts = np.cumsum(lengths) - lengths
+    return "\x00".join(texts), starts
+
+
+def _first_matches(pattern, joined, starts):
+    # (rows, matches) for the first match of pattern in each row that has one.
+    matches = list(pattern.finditer(joined))
+    rows = np.searchsorted(starts, [m.start() for m in matches], side="right") - 1
+    rows, first = np.unique(rows, return_index=True)
+    return rows, [matches[i] for i in first]
+
+
+def diet_masks(texts, joined=None):
+    joined, starts = joined or _joined(texts)
+    mask = np.zeros(len(starts), dtype=np.int64)
+    for tag, patterns in PATTERNS.items():
+        for pattern in patterns:
+            rows, _ = _first_matches(pattern, joined, starts)
+            mask[rows] |= TAG_BITS[tag]
+    return mask
+
+
+def labels(masks):
+    # dietary_info text for each mask ("Gluten-Free, Vegan" or "None"),
+    # computed once per distinct mask.
+    codes, uniques = pd.factorize(np.asarray(masks, dtype=np.int64))
+    names = np.array([", ".join(t for t, bit in TAG_BITS.items() if m & bit) or "None" for m in uniques], dtype=object)
+    return names[codes]
+
+
+def price_bands(prices):
+    prices = pd.to_numeric(pd.Series(prices), errors="coerce").to_numpy(dtype=np.float64)
+    bands = np.searchsorted(PRICE_BANDS, prices, side="right").astype(np.float64)
+    bands[np.isnan(prices)] = np.nan
+    return bands
+
+
+def quantities(texts, joined=None):
+    # (pack_count, net_quantity, quantity_unit) per text from the first size
+    # mentioned; pack_count defaults to 1, quantity fields are NaN/None when
+    # no size is mentioned.
+    joined, starts = joined or _joined(texts)
+    packs = np.ones(len(starts), dtype=np.int64)
+    amount = np.full(len(starts), np.nan)
+    unit = np.full(len(starts), None, dtype=object)
+    sizes = list(SIZE.finditer(joined.translate(DIGITS)))
+    for kind in ("pack", "unit"):
+        found = [m for m in sizes if m.group(kind)]
+        if kind == "pack":
+            # A pack count is a whole number: "1.5 pack" or ".5 pack" is
+            # no pack count at all.
+            found = [m for m in found if not m.group("fraction") and joined[m.start() - 1:m.start()] != "."]
+        rows = np.searchsorted(starts, [m.start() for m in found], side="right") - 1
+        rows, first = np.unique(rows, return_index=True)
+        for row, i in zip(rows.tolist(), first.tolist()):
+            m = found[i]
+            number = joined[m.start():m.start(kind)].rstrip(" \t\n\r\f\v-")
+            if kind == "pack":
+                packs[row] = int(number)
+            else:
+                factor, unit[row] = UNITS[re.sub(r"\s+", "", m.group(kind))]
+                amount[row] = float(number) * factor
+    return packs, amount, unit
+
+
+def tag_frame(df):
+    # Adds TAG_COLUMNS and dietary_info to a frame with product_name,
+    # description and price (and optionally a dietary_info to keep as input).
+    text = df["product_name"].fillna("") + " " + df["description"].fillna("")
+    if "dietary_info" in df:
+        text = text + " " + df["dietary_info"].fillna("")
+    joined = _joined(text)
+    df["diet_mask"] = diet_masks(text, joined)
+    df["dietary_info"] = labels(df["diet_mask"])
+    df["price_band"] = price_bands(df["price"])
+    df["pack_count"], df["net_quantity"], df["quantity_unit"] = quantities(text, joined)
+    return df
+
+
+def required_bits(diet):
+    # Filter spec -> list of bit groups; a product passes when it has at
+    # least one bit of every group. Accepts an int mask, a tag, or
+    # comma-separated tags; a tag matches every label containing it, as the
+    # old LIKE '%diet%' filter did ("Gluten" -> Gluten-Free).
+    if isinstance(diet, (int, np.integer)):
+        return [bit for bit in TAG_BITS.values() if diet & bit]
+    groups = []
+    for part in str(diet).split(","):
+        part = part.strip().lower()
+        if not part or part == "none":
+            continue
+        groups.append(sum(bit for tag, bit in TAG_BITS.items() if part in tag.lower()))
+    return groups
+
+
+def matches(masks, diet):
+    # Boolean array: which diet_mask values satisfy the filter.
+    masks = np.asarray(masks, dtype=np.int64)
+    result = np.ones(len(masks), dtype=bool)
+    for group in required_bits(diet):
+        result &= (masks & group) != 0
+    return result
@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# Per-stage timers, counters and histograms for the request path. Off unless
+# TELEMETRY=1 (or enable() is called): a disabled timer() returns one shared
+# no-op context and count()/observe() return on the first check, so the
+# instrumented code pays one global lookup per call site.
+enabled = os.environ.get("TELEMETRY", "0") == "1"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+counters = {}
+histograms = {}
+sources = {}
+last_request = None
+_lock = threading.Lock()
+_local = threading.local()
+_NULL = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return 0.0
+        target, seen = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    global last_request
+    with _lock:
+        counters.clear()
+        histograms.clear()
+        last_request = None
+
+
+def count(name, n=1):
+    if not enabled:
+        return
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+def observe(name, value, buckets=SIZE_BUCKETS):
+    if not enabled:
+        return
+    with _lock:
+        hist = histograms.get(name)
+        if hist is None:
+            hist = histograms[name] = Histogram(buckets)
+        hist.observe(value)
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        observe(f"{self.name}_seconds", seconds, LATENCY_BUCKETS)
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace["stages"][self.name] = trace["stages"].get(self.name, 0.0) + seconds
+
+
+def timer(name):
+    # Times the block into the <name>_seconds histogram and, inside
+    # request(), into that request's stage breakdown.
+    return _Timer(name) if enabled else _NULL
+
+
+class _Request(_Timer):
+    __slots__ = ("trace", "outer")
+
+    def __enter__(self):
+        self.outer = getattr(_local, "trace", None)
+        self.trace = {"request": self.name, "stages": {}, "values": {}}
+        _local.trace = self.trace
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        global last_request
+        self.trace["seconds"] = time.perf_counter() - self.start
+        _local.trace = self.outer
+        observe(f"{self.name}_seconds", self.trace["seconds"], LATENCY_BUCKETS)
+        last_request = self.trace
+
+
+def request(name):
+    # Outermost timer of one request; its breakdown becomes last_request.
+    return _Request(name) if enabled else _NULL
+
+
+def note(name, value):
+    # Attach a value (e.g. candidate-set size) to the current request trace.
+    if not enabled:
+        return
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["values"][name] = value
+
+
+def register(name, fn):
+    # fn() -> flat dict of numbers, included in stats() and prometheus().
+    sources[name] = fn
+
+
+def rate(rows_counter, timer_name):
+    hist = histograms.get(f"{timer_name}_seconds")
+    rows = counters.get(rows_counter, 0)
+    return rows / hist.sum if hist is not None and hist.sum else 0.0
+
+
+def stats():
+    with _lock:
+        result = {
+            "enabled": enabled,
+            "counters": dict(counters),
+            "histograms": {name: hist.summary() for name, hist in histograms.items()},
+        }
+    for name, fn in sources.items():
+        try:
+            result[name] = fn()
+        except Exception as exc:
+            result[name] = {"error": str(exc)}
+    result["last_request"] = last_request
+    return result
+
+
+def prometheus(prefix="sparkathon"):
+    # Prometheus text exposition format (counters, histograms, source gauges).
+    lines = []
+    with _lock:
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, hist in sorted(histograms.items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            seen = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                seen += n
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {seen}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {hist.count}')
+            lines.append(f"{metric}_sum {hist.sum}")
+            lines.append(f"{metric}_count {hist.count}")
+    for source, fn in sorted(sources.items()):
+        try:
+            values = fn()
+        except Exception:
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{source}_{key} gauge")
+                lines.append(f"{prefix}_{source}_{key} {value}")
+    return "\n".join(lines) + "\n"
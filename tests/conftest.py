@@ -0,0 +1,40 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend
+import benchmark
+import db
+
+CSV_HEADER = "Product Name,Brand,Category,Sale Price,Description,Available\n"
+CSV_ROWS = [
+    ("Dove Shampoo", "Dove", "Hair Care", "", "gentle shampoo for dry hair", "FALSE"),
+    ("Pantene Shampoo", "Pantene", "Hair Care", "6.99", "shampoo for dry hair", "TRUE"),
+    ("Head Shampoo", "Head", "Hair Care", "8.49", "anti dandruff shampoo", "TRUE"),
+    ("Suave Conditioner", "Suave", "Hair Care", "3.99", "conditioner for dry hair", "TRUE"),
+    ("Lays Chips", "Lays", "Snacks", "2.50", "salted potato chips 12 oz", "TRUE"),
+    ("Ruffles Chips", "Ruffles", "Snacks", "", "ridged potato chips", "TRUE"),
+    ("Pringles Chips", "Pringles", "Snacks", "2.99", "potato crisps 6 pack", "TRUE"),
+    ("Cheetos Puffs", "Cheetos", "Snacks", "", "cheese puffs", "TRUE"),
+]
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    # A fresh products database with a small catalog, embedded with the
+    # benchmark's hashing encoder; every backend cache starts empty.
+    path = tmp_path / "products.csv"
+    path.write_text(CSV_HEADER + "".join(",".join(row) + "\n" for row in CSV_ROWS))
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "products.db"))
+    monkeypatch.setattr(backend, "EMBEDDINGS_PATH", str(tmp_path / "products.embeddings"))
+    monkeypatch.setattr(backend, "_model", benchmark.HashingEncoder())
+    for name in ("ann_index", "semantic_cache", "catalog_snapshot", "name_index", "lexical_index"):
+        monkeypatch.setattr(backend, name, None)
+    backend.query_embedding_cache.clear()
+    backend.init_db()
+    backend.load_csv_to_db(str(path))
+    backend.train_semantic_embeddings(progress=None)
+    yield path
+    db.close_connections()
@@ -0,0 +1,61 @@
+import json
+import pytest
+import backend
+import db
+import telemetry
+from embedding_store import build_store
+
+
+def test_base_product_without_price(catalog):
+    # Dove Shampoo has no Sale Price: its recommendations skip the
+    # same-price tier instead of failing on the comparison.
+    recs = backend.get_recommendations("Dove Shampoo", k=2)
+    assert [rec["category"] for rec in recs] == ["Hair Care", "Hair Care"]
+    assert "Dove Shampoo" not in [rec["product_name"] for rec in recs]
+
+
+def test_base_product_without_price_batched(catalog):
+    requests = [("Dove Shampoo", None, None, 0, 2), ("Lays Chips", None, None, 0, 2)]
+    single = [backend.get_recommendations(*request) for request in requests]
+    assert backend.get_recommendations_many(requests) == single
+
+
+def test_materialized_records_match_live(catalog):
+    # Ruffles Chips and Cheetos Puffs have no price: both paths return
+    # Cheetos Puffs with price None, and the records are plain JSON.
+    live = backend.get_recommendations("Ruffles Chips", k=3)
+    backend.rebuild_substitutes()
+    telemetry.reset()
+    telemetry.enable()
+    served = backend.get_recommendations("Ruffles Chips", k=3)
+    telemetry.enable(False)
+    assert telemetry.stats()["counters"]["materialized_hits"] == 1
+    assert [rec["product_id"] for rec in served] == [rec["product_id"] for rec in live]
+    for rec, expected in zip(served, live):
+        assert rec.pop("similarity") == pytest.approx(expected.pop("similarity"), abs=1e-5)
+        assert rec == expected
+    assert None in [rec["price"] for rec in served]
+    json.dumps(served, allow_nan=False)
+
+
+def test_added_product_with_unknown_stock(catalog):
+    backend.rebuild_substitutes()
+    product_id = backend.add_product({"product_name": "Kettle Chips", "category": "Snacks", "price": 3.49,
+                                      "in_stock": None, "description": "kettle cooked potato chips"})
+    assert backend.find_product("Kettle Chips")["product_id"] == product_id
+
+
+def test_remaps_store_published_by_another_process(catalog):
+    old = backend.get_semantic_index()
+    product_id = backend.add_product({"product_name": "Kettle Chips", "category": "Snacks", "price": 3.49,
+                                      "in_stock": 1, "description": "kettle cooked potato chips"})
+    assert product_id not in old
+    # What train_semantic_embeddings does in another process.
+    build_store(backend.EMBEDDINGS_PATH, backend.product_text_chunks, backend.encode_texts)
+    with db.transaction(immediate=True):
+        db.bump_version("embeddings_version")
+    index = backend.get_semantic_index()
+    assert index is not old and product_id in index
+    assert backend.get_semantic_index() is index
+    recs = backend.get_recommendations("Lays Chips", k=5)
+    assert "Kettle Chips" in [rec["product_name"] for rec in recs]
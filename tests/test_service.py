@@ -0,0 +1,19 @@
+import pytest
+import service
+
+
+def test_parse_request():
+    assert service.parse_request({"product": ["Lays Chips"], "k": ["5"], "min_rating": ["4"]}) == ("Lays Chips", None, None, 4.0, 5)
+
+
+@pytest.mark.parametrize("params", [
+    {"product": "a", "k": 0},
+    {"product": "a", "k": -1},
+    {"product": "a", "k": service.MAX_K + 1},
+    {"product": "a", "min_rating": "nan"},
+    {"product": "a", "min_rating": "inf"},
+    {"k": 3},
+])
+def test_parse_request_rejects(params):
+    with pytest.raises(ValueError):
+        service.parse_request(params)
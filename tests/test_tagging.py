@@ -0,0 +1,28 @@
+import numpy as np
+import tagging
+
+
+def test_pack_counts():
+    packs, amount, unit = tagging.quantities([
+        "Chips 6 pack",
+        "Water 12-pk 16.9 fl oz",
+        "Soda 1.5 pack",
+        "Soda .5 pack",
+        "Juice 1.5 pack then a 4 ct box",
+        "no size",
+    ])
+    assert packs.tolist() == [6, 12, 1, 1, 4, 1]
+    assert np.allclose(amount[1], 16.9 * 29.5735) and unit[1] == "ml"
+    assert np.isnan(amount[0]) and unit[0] is None
+
+
+def test_net_quantity():
+    packs, amount, unit = tagging.quantities(["Rice 2 kg", "Milk 1.5 l", "Chips 12oz 3-pack"])
+    assert packs.tolist() == [1, 1, 3]
+    assert np.allclose(amount, [2000.0, 1500.0, 12 * 28.3495])
+    assert unit.tolist() == ["g", "ml", "g"]
+
+
+def test_diet_masks():
+    masks = tagging.diet_masks(["Gluten free vegan bread", "No added sugar jam", "plain"])
+    assert tagging.labels(masks).tolist() == ["Gluten-Free, Vegan", "Sugar-Free", "None"]
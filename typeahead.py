@@ -0,0 +1,56 @@
+import re
+from bisect import bisect_left
+
+TOKEN = re.compile(r"\w+")
+MAX_SCAN = 5000
+
+
+def tokens(text):
+    return TOKEN.findall(text.lower())
+
+
+class TypeaheadIndex:
+    # Prefix/token search over product names. Whole-name prefixes come from a
+    # sorted list of names, word prefixes from a sorted (token, name) list;
+    # both are binary searches, so a keystroke never scans the catalog.
+    def __init__(self, names):
+        self.names = sorted(set(n for n in names if isinstance(n, str) and n.strip()), key=str.lower)
+        self.keys = [n.lower() for n in self.names]
+        pairs = sorted({(tok, i) for i, key in enumerate(self.keys) for tok in tokens(key)})
+        self.tokens = [tok for tok, _ in pairs]
+        self.token_names = [i for _, i in pairs]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefix_range(self, keys, prefix):
+        return bisect_left(keys, prefix), bisect_left(keys, prefix + "\uffff")
+
+    def search(self, query, limit=10):
+        query = query.strip().lower()
+        if not query:
+            return []
+        # 1. Names that start with the query, in alphabetical order.
+        lo, hi = self._prefix_range(self.keys, query)
+        found = list(range(lo, min(hi, lo + limit)))
+        if len(found) == limit:
+            return [self.names[i] for i in found]
+        # 2. Names where every query word is a prefix of some word in the name,
+        #    driven by the query word with the fewest candidates.
+        words = tokens(query)
+        if not words:
+            return [self.names[i] for i in found]
+        ranges = sorted((self._prefix_range(self.tokens, w) for w in words), key=lambda r: r[1] - r[0])
+        lo, hi = ranges[0]
+        seen = set(found)
+        for pos in range(lo, min(hi, lo + MAX_SCAN)):
+            i = self.token_names[pos]
+            if i in seen:
+                continue
+            name_tokens = tokens(self.keys[i])
+            if all(any(t.startswith(w) for t in name_tokens) for w in words):
+                seen.add(i)
+                found.append(i)
+                if len(found) == limit:
+                    break
+        return [self.names[i] for i in found]